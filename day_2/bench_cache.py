@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the cache backends with packed rides from the saved routes panel.
+Usage: python bench_cache.py [number_of_routes] [backend ...]
+Backends: memory, sqlite (temporary file), redis (configs/redis.json, the benchmark keys are deleted at the end).
+"""
+import os
+import sys
+import json
+import time
+import datetime
+import tempfile
+
+from lxml import html
+
+from src.CacheBackend import CacheBackend
+from src.PackedRides import PackedRides
+from src.StudentAgencyParser import StudentAgencyParser
+
+# Config
+routes = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+backends = sys.argv[2:] or ['memory', 'sqlite']
+batch_size = 31
+input_data = {
+    'from': u'Praha',
+    'to': u'Brno',
+    'departure': datetime.datetime(2016, 11, 9),
+}
+
+tree = html.fromstring(open('test_inputs/routes_panel.html').read())
+blob = PackedRides.pack(StudentAgencyParser().parse_rides_tree(tree, 10202003, 10202002, input_data))
+keys = ['bench_connection_{0}'.format(i) for i in range(routes)]
+batches = [keys[i:i + batch_size] for i in range(0, routes, batch_size)]
+
+for backend in backends:
+    if backend == 'sqlite':
+        file_handle, db_path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(file_handle)
+        cache = CacheBackend.from_config({'backend': 'sqlite', 'path': db_path})
+    elif backend == 'redis':
+        cache = CacheBackend.from_config(json.load(open('../configs/redis.json')))
+    else:
+        cache = CacheBackend.from_config({'backend': backend})
+    results = []
+    start = time.time()
+    for key in keys:
+        cache.set(key, blob, 600)
+    results.append(('set', time.time() - start, routes))
+    start = time.time()
+    for key in keys:
+        cache.get(key)
+    results.append(('get', time.time() - start, routes))
+    start = time.time()
+    for batch in batches:
+        cache.set_many(dict.fromkeys(batch, blob), 600)
+    results.append(('set_many', time.time() - start, routes))
+    start = time.time()
+    for batch in batches:
+        cache.get_many(batch)
+    results.append(('get_many', time.time() - start, routes))
+    print('{0} ({1} routes, {2} B per route, batches of {3}):'.format(backend, routes, len(blob), batch_size))
+    for name, total, count in results:
+        print('  {0:<10} {1:8.1f} us per key'.format(name, total / count * 1000000))
+    # Clean up
+    if backend == 'sqlite':
+        os.remove(db_path)
+    elif backend == 'redis':
+        cache.redis.delete(*keys)
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark of rides extraction from saved routes panels.
+Usage: python bench_parser.py [number_of_runs] [fixture.html ...]
+"""
+import sys
+import glob
+import timeit
+import datetime
+
+from lxml import html
+
+from src.StudentAgencyParser import StudentAgencyParser
+
+# Config
+runs = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+fixtures = sys.argv[2:] or sorted(glob.glob('test_inputs/routes_panel*.html'))
+input_data = {
+    'from': u'Praha',
+    'to': u'Brno',
+    'departure': datetime.datetime(2016, 11, 9),
+}
+
+sa_parser = StudentAgencyParser()
+
+for fixture in fixtures:
+    tree = html.fromstring(open(fixture).read())
+    rides_count = len(sa_parser.parse_rides_tree(tree, 10202003, 10202002, input_data))
+    total = timeit.timeit(lambda: sa_parser.parse_rides_tree(tree, 10202003, 10202002, input_data), number=runs)
+    per_page = total / runs * 1000
+    print('{0}: {1} rides, {2:.3f} ms per page, {3:.1f} us per ride'
+          .format(fixture, rides_count, per_page, per_page * 1000 / max(rides_count, 1)))
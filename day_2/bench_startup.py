@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of cold start (i.e. for short-lived jobs). Every scenario runs in a new Python process,
+the time of the scenario itself and of the whole process is measured. Heavy modules loaded by the scenario are listed.
+Usage: python bench_startup.py [number_of_runs]
+"""
+import sys
+import json
+import time
+import subprocess
+
+# Config
+runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+heavy_modules = ['grab', 'lxml', 'redis', 'requests', 'unidecode']
+scenarios = [
+    ('python', 'pass'),
+    ('import RidesGetter', 'from src.RidesGetter import RidesGetter'),
+    ('create RidesGetter', 'from src.RidesGetter import RidesGetter\n'
+                           'r_getter = RidesGetter({"host": "localhost"}, {"client_id": "x", "client_secret": "x"})'),
+    ('slugify', 'from src.RidesGetter import RidesGetter\n'
+                'RidesGetter({"host": "localhost"}).slugify(u"Frýdek-Místek")'),
+    ('create parser', 'from src.StudentAgencyParser import StudentAgencyParser\n'
+                      'StudentAgencyParser()'),
+]
+measure = '''# -*- coding: utf-8 -*-
+import sys, time, json
+start = time.time()
+{0}
+print(json.dumps([time.time() - start, [m for m in {1} if m in sys.modules]]))
+'''
+
+for name, code in scenarios:
+    scenario_times, process_times = [], []
+    for _ in range(runs):
+        start = time.time()
+        output = subprocess.check_output([sys.executable, '-c', measure.format(code, heavy_modules)])
+        process_times.append(time.time() - start)
+        scenario_time, loaded_modules = json.loads(output)
+        scenario_times.append(scenario_time)
+    print('{0:<20} {1:8.1f} ms  (process {2:6.1f} ms)  loaded: {3}'
+          .format(name, sorted(scenario_times)[runs // 2] * 1000, sorted(process_times)[runs // 2] * 1000,
+                  ', '.join(loaded_modules) or '-'))
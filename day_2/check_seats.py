@@ -1,19 +1,34 @@
 # -*- coding: utf-8 -*-
+import os
 import json
+from functools import partial
 
 from src.RidesGetter import RidesGetter
+from src.SeatWatcher import SeatWatcher
 
 # Config
-r_getter = RidesGetter(json.load(open('configs/redis.json')), json.load(open('configs/gosms.json')))
+cache_config = json.load(open('configs/cache.json' if os.path.exists('configs/cache.json') else 'configs/redis.json'))
+r_getter = RidesGetter(cache_config, json.load(open('configs/gosms.json')))
+watcher = SeatWatcher(r_getter)
 
-# Get input data
-input_data = {
-    'from': u'Praha',
-    'to': u'Brno',    # Brno, Frýdek-Místek
-    'departure': '2016-11-09',
-}
+# Get input data (watches of the same route share one scrape)
+watches = [
+    {'from': u'Praha', 'to': u'Brno', 'departure': '2016-11-09', 'min_seats': 1, 'mobile': '+420000000000'},
+    {'from': u'Praha', 'to': u'Brno', 'departure': '2016-11-09', 'min_seats': 2, 'mobile': '+420000000001'},
+]
 
-# Get results
-parsed_input = r_getter.parse_input(json.dumps(input_data))
-result = r_getter.check_seats(parsed_input, 52, '+420000000000')
-print result
+
+def send_notification(mobile_send_number, watch, rides):
+    msg = ('Seat freed for bus on {0} at {1}.'
+           .format(watch['input_data']['departure'].strftime('%d.%m.%Y'), rides[0]['departure'][-5:]))
+    # Queued, so the polling never waits for the SMS API. Same messages are sent in one batch.
+    r_getter.sms_mailer.queue_sms(msg, mobile_send_number)
+    print msg
+
+
+# Register watches and poll until all of them fire
+for w in watches:
+    parsed_input = r_getter.parse_input(json.dumps(w))
+    watcher.add_watch(parsed_input, w['min_seats'], partial(send_notification, w['mobile']))
+watcher.run()
+r_getter.sms_mailer.flush()
@@ -1,6 +1,10 @@
+import os
 import json
+import datetime
+import threading
 
 from flask import Flask
+from flask import Response
 from flask import request
 
 from src.RidesGetter import RidesGetter
@@ -9,8 +13,25 @@ from src.RidesGetter import RidesGetter
 app = Flask(__name__)
 app.config['PROPAGATE_EXCEPTIONS'] = True
 
-redis_config = json.load(open('../configs/redis.json'))
-r_getter = RidesGetter(redis_config, True)
+r_getter = None  # Created on the first request (see get_rides_getter()), tests can set their own.
+r_getter_lock = threading.Lock()
+MAX_BATCH_QUERIES = 31
+
+
+def get_rides_getter():
+    global r_getter
+    with r_getter_lock:
+        if r_getter is not None:
+            return r_getter
+        # Cache backend (configs/cache.json, i.e. {"backend": "memory"}), Redis by default (see src/CacheBackend.py)
+        cache_config = json.load(open('../configs/cache.json' if os.path.exists('../configs/cache.json')
+                                      else '../configs/redis.json'))
+        # Optional base URLs of upstream sites (i.e. a local stub server, see upstream_stub.py)
+        upstream_config = None
+        if os.path.exists('../configs/upstream.json'):
+            upstream_config = json.load(open('../configs/upstream.json'))
+        r_getter = RidesGetter(cache_config, parser_config=upstream_config)
+        return r_getter
 
 
 # Search method
@@ -21,7 +42,44 @@ def search():
         'to': request.args.get("city_to", "all"),
         'departure': request.args.get("date", '2017-01-01')
     }
+    r_getter = get_rides_getter()
     parsed_input = r_getter.parse_input(json.dumps(input_data))
     rides = r_getter.get_rides(parsed_input['from'], parsed_input['to'], parsed_input['departure'], parsed_input)
     return rides
 
+
+# Search method for more dates or routes at once
+@app.route("/search_batch", methods=['GET', 'POST'])
+def search_batch():
+    """
+    GET: one route for a range of dates (city_from, city_to, date_from, date_to).
+    POST: JSON list of queries - [{"from": "Praha", "to": "Brno", "departure": "2017-01-01"}, ...]
+    Rides of all queries are merged and sorted by the "sort" argument (price or departure).
+    """
+    r_getter = get_rides_getter()
+    if request.method == 'POST':
+        queries = [r_getter.parse_input(json.dumps(q)) for q in request.get_json(force=True)]
+    else:
+        date_from = datetime.datetime.strptime(request.args.get("date_from", '2017-01-01'), '%Y-%m-%d')
+        date_to = datetime.datetime.strptime(request.args.get("date_to", request.args.get("date_from", '2017-01-01')), '%Y-%m-%d')
+        queries = [{
+            'from': request.args.get("city_from", "all"),
+            'to': request.args.get("city_to", "all"),
+            'departure': date_from + datetime.timedelta(days=d),
+        } for d in range((date_to - date_from).days + 1)]
+    if not 0 < len(queries) <= MAX_BATCH_QUERIES:
+        return Response('Number of queries must be between 1 and {0}.'.format(MAX_BATCH_QUERIES), status=400)
+    sort_by = request.args.get("sort", "price")
+    if sort_by not in ('price', 'departure'):
+        return Response('Rides can be sorted only by price or departure.', status=400)
+
+    rides = [ride for query_rides in r_getter.get_rides_batch(queries) if query_rides for ride in query_rides]
+    rides.sort(key=lambda r: (r[sort_by], r['departure']))
+
+    # Stream the rides one by one instead of building one big string.
+    def generate():
+        yield '['
+        for r_n, ride in enumerate(rides):
+            yield (',' if r_n else '') + json.dumps(ride)
+        yield ']'
+    return Response(generate(), mimetype='application/json')
@@ -1,10 +1,12 @@
 # -*- coding: utf-8 -*-
+import os
 import json
 
 from src.RidesGetter import RidesGetter
 
 # Config
-r_getter = RidesGetter(json.load(open('configs/redis.json')), json.load(open('configs/gosms.json')))
+cache_config = json.load(open('configs/cache.json' if os.path.exists('configs/cache.json') else 'configs/redis.json'))
+r_getter = RidesGetter(cache_config, json.load(open('configs/gosms.json')))
 
 # Get input data
 input_data = {
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Load test of the /search endpoint of flask_get_rides.py (run it against upstream_stub.py).
+Usage: python load_test.py [--url http://127.0.0.1:5000/search] [--rps 50] [--duration 30]
+
+Requests are sent at a fixed rate (open loop), so a slow server does not lower the offered load.
+At the end, latency percentiles, upstream calls per request and cache hit ratio are printed.
+"""
+import json
+import time
+import random
+import urllib
+import urllib2
+import argparse
+import datetime
+import threading
+import Queue
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def get_json(url):
+    return json.loads(urllib2.urlopen(url, timeout=10).read())
+
+
+def worker(url, tasks, results):
+    while True:
+        query = tasks.get()
+        if query is None:
+            return
+        start = time.time()
+        try:
+            urllib2.urlopen(url + '?' + urllib.urlencode(query), timeout=30).read()
+            ok = True
+        except Exception:
+            ok = False
+        results.put((time.time() - start, ok))
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Load test of the rides search.')
+    arg_parser.add_argument('--url', default='http://127.0.0.1:5000/search')
+    arg_parser.add_argument('--stub', default='http://127.0.0.1:8090', help='URL of upstream_stub.py.')
+    arg_parser.add_argument('--rps', type=float, default=50, help='Target requests per second.')
+    arg_parser.add_argument('--duration', type=float, default=30, help='Duration of the test (s).')
+    arg_parser.add_argument('--concurrency', type=int, default=64, help='Maximal number of open requests.')
+    arg_parser.add_argument('--cities', default='Praha,Brno,Ostrava,Olomouc,Plzeň', help='Cities to combine.')
+    arg_parser.add_argument('--days', type=int, default=7, help='Number of departure dates to query.')
+    arg_parser.add_argument('--start-date', default=datetime.date.today().strftime('%Y-%m-%d'))
+    args = arg_parser.parse_args()
+
+    # Queries: all pairs of cities for all dates
+    cities = args.cities.split(',')
+    start_date = datetime.datetime.strptime(args.start_date, '%Y-%m-%d')
+    dates = [(start_date + datetime.timedelta(days=d)).strftime('%Y-%m-%d') for d in range(args.days)]
+    queries = [{'city_from': c_from, 'city_to': c_to, 'date': date}
+               for c_from in cities for c_to in cities if c_from != c_to for date in dates]
+
+    # Start workers
+    tasks, results = Queue.Queue(), Queue.Queue()
+    threads = [threading.Thread(target=worker, args=(args.url, tasks, results)) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    urllib2.urlopen(args.stub + '/_reset').read()
+
+    # Offer the load
+    sent = 0
+    test_start = time.time()
+    while time.time() - test_start < args.duration:
+        tasks.put(random.choice(queries))
+        sent += 1
+        time.sleep(max(0.0, test_start + sent / args.rps - time.time()))
+    for _ in threads:
+        tasks.put(None)
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - test_start
+
+    # Report
+    latencies, errors = [], 0
+    while not results.empty():
+        latency, ok = results.get()
+        latencies.append(latency * 1000)
+        errors += 0 if ok else 1
+    latencies.sort()
+    upstream = get_json(args.stub + '/_stats')
+    upstream_calls = sum(v for k, v in upstream.items() if k != 'errors')
+    scrapes = upstream.get('routes', 0)
+    print('Requests:       {0} ({1:.1f} rps achieved, {2} errors)'.format(sent, sent / elapsed, errors))
+    print('Latency:        p50 {0:.1f} ms, p99 {1:.1f} ms, max {2:.1f} ms'
+          .format(percentile(latencies, 50), percentile(latencies, 99), latencies[-1] if latencies else 0))
+    print('Upstream calls: {0} ({1:.2f} per request, {2})'
+          .format(upstream_calls, float(upstream_calls) / max(sent, 1), json.dumps(upstream, sort_keys=True)))
+    print('Cache hits:     {0:.1%} (scrapes of the routes panel: {1})'.format(1 - float(scrapes) / max(sent, 1), scrapes))
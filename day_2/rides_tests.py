@@ -0,0 +1,810 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import time
+import unittest
+import threading
+import os.path
+import datetime
+
+from lxml import html
+
+from src import MemoryCache as memory_cache_module, SqliteCache as sqlite_cache_module
+from src.MemoryCache import MemoryCache
+from src.PackedRides import PackedRides
+from src.RidesGetter import RidesGetter
+from src.SeatWatcher import SeatWatcher
+from src.SmsMailer import SmsMailer
+from src.SqliteCache import SqliteCache
+from src.StudentAgencyParser import StudentAgencyParser
+import serve_rides
+import flask_get_rides
+
+# Filepaths
+current_dir = os.path.dirname(os.path.realpath(__file__))
+test_inputs_dir = os.path.abspath(current_dir+'/test_inputs')
+
+# Saved routes panel: Praha (10202003) -> Brno (10202002), 9. 11. 2016
+input_data = {
+    'from': u'Praha',
+    'to': u'Brno',
+    'departure': datetime.datetime(2016, 11, 9),
+}
+
+
+def parse_routes_panel(id_from=10202003, id_to=10202002, **kwargs):
+    with open(test_inputs_dir + '/routes_panel.html') as panel_file:
+        tree = html.fromstring(panel_file.read())
+    return StudentAgencyParser().parse_rides_tree(tree, id_from, id_to, input_data, **kwargs)
+
+
+# Test classes
+class TestPackedRides(unittest.TestCase):
+    """
+    Check that packed rides are decoded to the same rides as scraped, and that rides cached as JSON
+    (before the packed format) can still be read.
+    """
+
+    def setUp(self):
+        self.rides = parse_routes_panel()
+
+    def test_round_trip(self):
+        """
+        Packed and decoded rides are equal to the parsed ones (in the same order).
+        """
+        packed = PackedRides(PackedRides.pack(self.rides))
+        self.assertEqual(len(packed), len(self.rides))
+        self.assertEqual(packed.to_list(), self.rides)
+        self.assertEqual(json.loads(packed.to_json()), json.loads(json.dumps(self.rides)))
+
+    def test_missing_type(self):
+        """
+        Rides without a type are decoded without the 'type' key (not with None).
+        """
+        for ride in self.rides[::2]:
+            del ride['type']
+        decoded = PackedRides(PackedRides.pack(self.rides)).to_list()
+        self.assertEqual(decoded, self.rides)
+        self.assertNotIn('type', decoded[0])
+        self.assertIn('type', decoded[1])
+
+    def test_is_packed(self):
+        """
+        Only values starting with the magic bytes are packed rides.
+        """
+        self.assertTrue(PackedRides.is_packed(PackedRides.pack(self.rides)))
+        self.assertFalse(PackedRides.is_packed(json.dumps(self.rides)))
+        self.assertFalse(PackedRides.is_packed('[]'))
+        self.assertFalse(PackedRides.is_packed(''))
+        self.assertFalse(PackedRides.is_packed(None))
+
+    def test_decode_cached_rides(self):
+        """
+        RidesGetter decodes packed and legacy JSON values to the same rides. Missing or empty values are None.
+        """
+        self.assertEqual(RidesGetter._decode_rides(PackedRides.pack(self.rides)), self.rides)
+        self.assertEqual(RidesGetter._decode_rides(json.dumps(self.rides)), json.loads(json.dumps(self.rides)))
+        self.assertIsNone(RidesGetter._decode_rides('[]'))
+        self.assertIsNone(RidesGetter._decode_rides(''))
+        self.assertIsNone(RidesGetter._decode_rides(None))
+
+
+class FakeClock(object):
+    """
+    Replacement of the time module in the cache backends (expiration without waiting).
+    """
+
+    def __init__(self):
+        self.now = time.time()
+
+    def time(self):
+        return self.now
+
+
+class CacheBackendTests(object):
+    """
+    Tests common for all cache backends (mixed into a TestCase with create_cache()).
+    """
+
+    cache_module = None
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache_module.time = self.clock
+        self.cache = self.create_cache()
+
+    def tearDown(self):
+        self.cache_module.time = time
+
+    def test_ttl_expiry(self):
+        """
+        Expired keys are None, keys without TTL stay.
+        """
+        self.cache.set('expiring', 'a', 10)
+        self.cache.set('permanent', 'b')
+        self.clock.now += 9
+        self.assertEqual(self.cache.get_many(['expiring', 'permanent']), ['a', 'b'])
+        self.clock.now += 2
+        self.assertEqual(self.cache.get_many(['expiring', 'permanent']), [None, 'b'])
+
+    def test_scalar_ttl(self):
+        """
+        A single TTL applies to all the keys.
+        """
+        self.cache.set_many({'a': 'a', 'b': 'b'}, 10)
+        self.clock.now += 11
+        self.assertEqual(self.cache.get_many(['a', 'b']), [None, None])
+
+    def test_dict_ttl(self):
+        """
+        TTL by key applies only to the listed keys, the other ones do not expire.
+        """
+        self.cache.set_many({'a': 'a', 'b': 'b', 'c': 'c'}, {'a': 10, 'b': 20})
+        self.clock.now += 11
+        self.assertEqual(self.cache.get_many(['a', 'b', 'c']), [None, 'b', 'c'])
+        self.clock.now += 10
+        self.assertEqual(self.cache.get_many(['a', 'b', 'c']), [None, None, 'c'])
+
+    def test_get_many_order(self):
+        """
+        Values are in the order of the keys (also repeated ones), missing keys are None.
+        """
+        self.cache.set_many({'a': '1', 'c': '3'})
+        self.assertEqual(self.cache.get_many(['c', 'missing', 'a', 'c']), ['3', None, '1', '3'])
+        self.assertEqual(self.cache.get_many([]), [])
+
+    def test_many_keys(self):
+        """
+        More keys than SQLite allows in one query are read in chunks.
+        """
+        keys = ['key_{0}'.format(i) for i in range(SqliteCache.MAX_VARIABLES * 2 + 100)]
+        self.cache.set_many(dict((key, key.upper()) for key in keys[::2]), 10)
+        values = self.cache.get_many(keys)
+        self.assertEqual(values[::2], [key.upper() for key in keys[::2]])
+        self.assertEqual(values[1::2], [None] * len(keys[1::2]))
+
+    def test_value_coercion(self):
+        """
+        Unicode values are stored in UTF-8 and numbers as strings (like in Redis).
+        """
+        self.cache.set_many({'city': u'Frýdek-Místek', 'city_id': 10202003})
+        self.assertEqual(self.cache.get_many(['city', 'city_id']), [u'Frýdek-Místek'.encode('utf-8'), '10202003'])
+        self.assertIsInstance(self.cache.get('city'), str)
+
+    def test_overwrite(self):
+        """
+        A key set again gets the new value and the new TTL.
+        """
+        self.cache.set('a', 'old', 10)
+        self.cache.set('a', 'new')
+        self.clock.now += 11
+        self.assertEqual(self.cache.get('a'), 'new')
+
+
+class TestMemoryCache(CacheBackendTests, unittest.TestCase):
+    """
+    Check the in-process cache, including eviction of the least recently used keys.
+    """
+
+    cache_module = memory_cache_module
+
+    def create_cache(self):
+        return MemoryCache()
+
+    def test_lru_eviction(self):
+        """
+        When the cache is full, the least recently used (read or written) keys are removed first.
+        """
+        cache = MemoryCache(max_items=3)
+        cache.set_many({'a': '1', 'b': '2'})
+        cache.set('c', '3')
+        cache.get('a')
+        cache.set('d', '4')
+        self.assertEqual(cache.get_many(['a', 'b', 'c', 'd']), ['1', None, '3', '4'])
+        cache.set('c', '5')
+        cache.set('e', '6')
+        self.assertEqual(cache.get_many(['a', 'c', 'd', 'e']), [None, '5', '4', '6'])
+
+
+class TestSqliteCache(CacheBackendTests, unittest.TestCase):
+    """
+    Check the SQLite cache (in a temporary database).
+    """
+
+    cache_module = sqlite_cache_module
+
+    def create_cache(self):
+        return SqliteCache(':memory:')
+
+
+class FakeParser(object):
+    """
+    Parser returning the saved routes panel instead of scraping (counts the scrapes).
+    """
+
+    def __init__(self, rides, delay=0):
+        self.rides = rides
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def get_rides(self, id_from, id_to, input_data):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        return self.rides
+
+
+class TestRidesGetterCache(unittest.TestCase):
+    """
+    Check that RidesGetter scrapes only the connections missing in the cache (memory backend).
+    """
+
+    def setUp(self):
+        self.rides = parse_routes_panel()
+        self.getter = RidesGetter({'backend': 'memory'}, fresh_seconds=600)
+        self.getter.sa_parser = FakeParser(self.rides)
+        self.getter.cache.set_many({'city_id_praha': 10202003, 'city_id_brno': 10202002})
+
+    def test_miss_then_hit(self):
+        """
+        The first request scrapes and caches the rides, the second one returns the same rides from the cache.
+        """
+        first = self.getter.get_rides(u'Praha', u'Brno', input_data['departure'], input_data)
+        self.assertEqual(self.getter.sa_parser.calls, 1)
+        second = self.getter.get_rides(u'Praha', u'Brno', input_data['departure'], input_data)
+        self.assertEqual(self.getter.sa_parser.calls, 1)
+        self.assertEqual(json.loads(first), json.loads(second))
+        self.assertEqual(json.loads(second), json.loads(json.dumps(self.rides)))
+
+    def test_cached_rides_fresh(self):
+        """
+        Scraped rides are cached packed and fresh. Other dates are not cached.
+        """
+        self.getter.get_rides(u'Praha', u'Brno', input_data['departure'], input_data)
+        connection_key = self.getter._get_connection_key(10202003, 10202002, input_data['departure'])
+        self.assertTrue(PackedRides.is_packed(self.getter.cache.get(connection_key)))
+        self.assertEqual(self.getter.get_cached_rides(10202003, 10202002, input_data['departure']), (self.rides, True))
+        self.assertEqual(self.getter.get_cached_rides(10202003, 10202002, datetime.datetime(2016, 11, 10)),
+                         (None, False))
+
+    def test_empty_revalidation(self):
+        """
+        When revalidation of stale rides scrapes no rides, the cached rides are kept and they are fresh again.
+        """
+        clock = FakeClock()
+        memory_cache_module.time = clock
+        try:
+            self.getter.get_rides(u'Praha', u'Brno', input_data['departure'], input_data)
+            clock.now += 601
+            self.assertEqual(self.getter.get_cached_rides(10202003, 10202002, input_data['departure']),
+                             (self.rides, False))
+            self.getter._store_rides(10202003, 10202002, input_data['departure'], [])
+            self.assertEqual(self.getter.get_cached_rides(10202003, 10202002, input_data['departure']),
+                             (self.rides, True))
+        finally:
+            memory_cache_module.time = time
+
+
+class SavedPageParser(StudentAgencyParser):
+    """
+    Parser which "loads" saved pages of the routes panel instead of scraping them (one page per scrape).
+    """
+
+    class Page(object):
+        def __init__(self, page_html):
+            self.doc = self
+            self.tree = html.fromstring(page_html)
+
+    def __init__(self, pages):
+        super(SavedPageParser, self).__init__()
+        self.pages = list(pages)
+
+    def _load_rides_panel(self, id_from, id_to, departure_date):
+        self._g = self.Page(self.pages.pop(0))
+
+
+class TestRidesChanges(unittest.TestCase):
+    """
+    Check that get_rides_changes() returns only the rides whose rows changed since the previous scrape.
+    """
+
+    def setUp(self):
+        with open(test_inputs_dir + '/routes_panel.html') as panel_file:
+            self.page = panel_file.read()
+        # Free seats of the third ride changed
+        self.changed_page = self.page.replace('<div class="col_space">12</div>', '<div class="col_space">11</div>', 1)
+
+    def test_first_scrape(self):
+        """
+        On the first scrape of a route, all rides are changed.
+        """
+        parser = SavedPageParser([self.page])
+        all_rides, changed_rides = parser.get_rides_changes(10202003, 10202002, input_data)
+        self.assertEqual(all_rides, parse_routes_panel())
+        self.assertEqual(changed_rides, all_rides)
+
+    def test_changed_seats(self):
+        """
+        Only the ride with changed seats is returned as changed. Unchanged rows are not parsed again
+        (the rides are the same dictionaries as from the previous scrape).
+        """
+        parser = SavedPageParser([self.page, self.changed_page, self.changed_page])
+        first_rides, _ = parser.get_rides_changes(10202003, 10202002, input_data)
+        second_rides, changed_rides = parser.get_rides_changes(10202003, 10202002, input_data)
+        self.assertEqual(len(second_rides), len(first_rides))
+        self.assertEqual(changed_rides, [second_rides[2]])
+        self.assertEqual(second_rides[2]['seats'], 11)
+        self.assertEqual(first_rides[2]['seats'], 12)
+        for i, (first, second) in enumerate(zip(first_rides, second_rides)):
+            if i != 2:
+                self.assertIs(second, first)
+        # Nothing changed since the second scrape
+        third_rides, changed_rides = parser.get_rides_changes(10202003, 10202002, input_data)
+        self.assertEqual(changed_rides, [])
+        self.assertIs(third_rides[2], second_rides[2])
+
+    def test_forget_route(self):
+        """
+        After the snapshot of the route is dropped, all rides are changed again.
+        """
+        parser = SavedPageParser([self.page, self.page])
+        parser.get_rides_changes(10202003, 10202002, input_data)
+        parser.forget_route(10202003, 10202002, input_data['departure'])
+        all_rides, changed_rides = parser.get_rides_changes(10202003, 10202002, input_data)
+        self.assertEqual(changed_rides, all_rides)
+
+
+class RecordingMailer(SmsMailer):
+    """
+    Mailer which records the messages instead of sending them.
+    """
+
+    def __init__(self):
+        super(RecordingMailer, self).__init__('client_id', 'client_secret', batch_wait=0.01)
+        self.sent = []
+        self.started_threads = []
+
+    def send_sms(self, msg, to_mobile, test_mode=True):
+        self.sent.append((msg, to_mobile))
+        return 200
+
+    def _send_queued(self):
+        self.started_threads.append(threading.current_thread())
+        super(RecordingMailer, self)._send_queued()
+
+
+class TestSms(unittest.TestCase):
+    """
+    Check queueing of SMS and check_seats() with and without the SMS config.
+    """
+
+    def test_queue_from_threads(self):
+        """
+        Messages queued from more threads at once are sent by one background thread.
+        """
+        mailer = RecordingMailer()
+        threads = [threading.Thread(target=mailer.queue_sms, args=('Seat freed', '+42000000000{0}'.format(i)))
+                   for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        mailer.flush()
+        self.assertEqual(len(mailer.started_threads), 1)
+        self.assertEqual(sorted(number for _, numbers in mailer.sent for number in numbers),
+                         ['+42000000000{0}'.format(i) for i in range(10)])
+
+    def test_check_seats_without_sms_config(self):
+        """
+        Without sms_config, check_seats() reports an error instead of failing.
+        """
+        getter = RidesGetter({'backend': 'memory'})
+        self.assertIsNone(getter.sms_mailer)
+        self.assertTrue(getter.check_seats(input_data, 1, '+420000000000').startswith('Error while sending SMS'))
+
+    def test_check_seats(self):
+        """
+        The SMS with the reservation is queued and sent after flush().
+        """
+        getter = RidesGetter({'backend': 'memory'})
+        getter.sms_mailer = RecordingMailer()
+        getter.cache.set_many({'city_id_praha': 10202003, 'city_id_brno': 10202002})
+        res_number = getter.check_seats(input_data, 1, '+420000000000')
+        getter.sms_mailer.flush()
+        self.assertEqual(getter.sms_mailer.sent,
+                         [('Seat freed for bus on 09.11.2016. Reservation: {0}'.format(res_number), ['+420000000000'])])
+
+
+class TestRidesServer(unittest.TestCase):
+    """
+    Check the production server: one scrape of a route at a time and stale rides served while they are refreshed.
+    """
+
+    url = '/search?city_from=Praha&city_to=Brno&date=2016-11-09'
+
+    def setUp(self):
+        self.rides = parse_routes_panel()
+        self.parser = FakeParser(self.rides, delay=0.05)
+        self.getter = RidesGetter({'backend': 'memory'}, fresh_seconds=600)
+        self.getter._create_sa_parser = lambda: self.parser
+        self.getter.cache.set_many({'city_id_praha': 10202003, 'city_id_brno': 10202002})
+        serve_rides.configure(self.getter, scrapes=2, timeout=5)
+        self.client = serve_rides.app.test_client()
+
+    def tearDown(self):
+        for result in serve_rides.in_progress.values():
+            result.get()
+        memory_cache_module.time = time
+
+    def test_miss_then_hit(self):
+        """
+        Missing rides are scraped and returned, the next request is served from the cache.
+        """
+        for _ in range(2):
+            response = self.client.get(self.url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.data), json.loads(json.dumps(self.rides)))
+        self.assertEqual(self.parser.calls, 1)
+
+    def test_one_scrape_at_a_time(self):
+        """
+        Refresh of a route which is being scraped waits for the running scrape.
+        """
+        first = serve_rides.refresh_rides(10202003, 10202002, input_data)
+        second = serve_rides.refresh_rides(10202003, 10202002, input_data)
+        self.assertIs(second, first)
+        self.assertEqual(first.get(timeout=5), self.rides)
+        self.assertEqual(self.parser.calls, 1)
+        self.assertEqual(serve_rides.in_progress, {})
+
+    def test_stale_while_revalidate(self):
+        """
+        Stale rides are returned right away and refreshed in the background.
+        """
+        clock = FakeClock()
+        memory_cache_module.time = clock
+        self.getter._store_rides(10202003, 10202002, input_data['departure'], self.rides)
+        clock.now += 601
+        self.parser.rides = [dict(ride, seats=ride['seats'] + 1) for ride in self.rides]
+        response = self.client.get(self.url)
+        self.assertEqual(json.loads(response.data), json.loads(json.dumps(self.rides)))
+        self.assertEqual(len(serve_rides.in_progress), 1)
+        serve_rides.in_progress.values()[0].get(timeout=5)
+        self.assertEqual(self.parser.calls, 1)
+        self.assertEqual(self.getter.get_cached_rides(10202003, 10202002, input_data['departure']),
+                         (self.parser.rides, True))
+
+    def test_timeout(self):
+        """
+        A slow scrape ends with 504, but it finishes and is cached anyway.
+        """
+        self.parser.delay = 0.5
+        serve_rides.configure(self.getter, scrapes=2, timeout=0.05)
+        self.assertEqual(self.client.get(self.url).status_code, 504)
+        serve_rides.in_progress.values()[0].get(timeout=5)
+        self.assertEqual(self.getter.get_cached_rides(10202003, 10202002, input_data['departure']), (self.rides, True))
+
+
+class DatedFakeParser(FakeParser):
+    """
+    Fake parser returning the saved rides moved to the requested date (every day later is 1 CZK more expensive).
+    """
+
+    def get_rides(self, id_from, id_to, input_data):
+        days = (input_data['departure'] - datetime.datetime(2016, 11, 9)).days
+        return [dict(ride, departure=self._move(ride['departure'], days), arrival=self._move(ride['arrival'], days),
+                     price=ride['price'] + days)
+                for ride in super(DatedFakeParser, self).get_rides(id_from, id_to, input_data)]
+
+    @staticmethod
+    def _move(time_str, days):
+        moved = datetime.datetime.strptime(time_str, '%Y-%m-%d %H:%M') + datetime.timedelta(days=days)
+        return moved.strftime('%Y-%m-%d %H:%M')
+
+
+class TestRidesBatch(unittest.TestCase):
+    """
+    Check get_rides_batch() and the /search_batch endpoint (memory backend, fake parser).
+    """
+
+    def setUp(self):
+        self.parser = DatedFakeParser(parse_routes_panel())
+        self.created_parsers = 0
+        self.getter = RidesGetter({'backend': 'memory'}, scrape_workers=2)
+        self.getter._create_sa_parser = self.create_parser
+        self.getter.cache.set_many({'city_id_praha': 10202003, 'city_id_brno': 10202002})
+        self.queries = [dict(input_data, departure=datetime.datetime(2016, 11, 9 + d)) for d in range(3)]
+        flask_get_rides.r_getter = self.getter
+        self.client = flask_get_rides.app.test_client()
+
+    def tearDown(self):
+        flask_get_rides.r_getter = None
+
+    def create_parser(self):
+        self.created_parsers += 1
+        return self.parser
+
+    def test_scrape_misses_once(self):
+        """
+        Only the missing connections are scraped (once each), a repeated batch is served from the cache.
+        """
+        self.getter.get_rides_batch(self.queries[1:2])
+        self.assertEqual(self.parser.calls, 1)
+        first = self.getter.get_rides_batch(self.queries)
+        self.assertEqual(self.parser.calls, 3)
+        second = self.getter.get_rides_batch(self.queries)
+        self.assertEqual(self.parser.calls, 3)
+        self.assertEqual(second, first)
+        for query, rides in zip(self.queries, first):
+            self.assertEqual(len(rides), 48)
+            self.assertTrue(all(r['departure'].startswith(query['departure'].strftime('%Y-%m-%d')) for r in rides))
+
+    def test_pool_reused(self):
+        """
+        All batches use the same pool, so the parsers of its threads are reused.
+        """
+        self.getter.get_rides_batch(self.queries[:2])
+        pool = self.getter.scrape_pool
+        self.getter.get_rides_batch(self.queries[2:])
+        self.assertIs(self.getter.scrape_pool, pool)
+        self.assertLessEqual(self.created_parsers, 2)
+
+    def test_search_batch_sort(self):
+        """
+        Rides of a date range are merged and sorted by price or departure.
+        """
+        url = '/search_batch?city_from=Praha&city_to=Brno&date_from=2016-11-09&date_to=2016-11-11&sort={0}'
+        by_price = json.loads(self.client.get(url.format('price')).data)
+        by_departure = json.loads(self.client.get(url.format('departure')).data)
+        self.assertEqual(len(by_price), 3 * 48)
+        self.assertEqual(by_price, sorted(by_price, key=lambda r: (r['price'], r['departure'])))
+        self.assertEqual([r['departure'] for r in by_departure], sorted(r['departure'] for r in by_price))
+        self.assertEqual(self.parser.calls, 3)
+
+    def test_search_batch_post(self):
+        """
+        Queries can be posted as a JSON list (rides are sorted by price by default).
+        """
+        queries = [{'from': u'Praha', 'to': u'Brno', 'departure': date} for date in ('2016-11-11', '2016-11-09')]
+        rides = json.loads(self.client.post('/search_batch', data=json.dumps(queries)).data)
+        self.assertEqual(len(rides), 2 * 48)
+        self.assertEqual(rides, sorted(rides, key=lambda r: (r['price'], r['departure'])))
+
+    def test_search_batch_errors(self):
+        """
+        Too many queries and an unknown sort are rejected without scraping.
+        """
+        url = '/search_batch?city_from=Praha&city_to=Brno&date_from=2016-11-01&date_to={0}&sort={1}'
+        self.assertEqual(self.client.get(url.format('2016-12-01', 'price')).status_code, 200)
+        self.assertEqual(self.client.get(url.format('2016-12-02', 'price')).status_code, 400)
+        queries = [{'from': u'Praha', 'to': u'Brno', 'departure': '2016-11-09'}] * 32
+        self.assertEqual(self.client.post('/search_batch', data=json.dumps(queries)).status_code, 400)
+        self.assertEqual(self.client.post('/search_batch', data='[]').status_code, 400)
+        self.assertEqual(self.client.get(url.format('2016-11-02', 'seats')).status_code, 400)
+        self.assertEqual(self.parser.calls, 31)
+
+
+# City IDs as returned from the cache
+PRAHA, BRNO, OSTRAVA = '10202003', '10202002', '10202000'
+
+
+def make_rides(departure_date, seats, id_to=BRNO):
+    """
+    Rides from Praha, one every two hours from 8:00, with the given numbers of free seats.
+    """
+    return [{
+        'from': PRAHA,
+        'to': id_to,
+        'departure': (departure_date + datetime.timedelta(hours=8 + 2 * i)).strftime('%Y-%m-%d %H:%M'),
+        'arrival': (departure_date + datetime.timedelta(hours=10 + 2 * i)).strftime('%Y-%m-%d %H:%M'),
+        'price': 199.0,
+        'from_name': u'Praha',
+        'to_name': u'Ostrava' if id_to == OSTRAVA else u'Brno',
+        'seats': ride_seats,
+    } for i, ride_seats in enumerate(seats)]
+
+
+class ScriptedParser(object):
+    """
+    Parser for SeatWatcher returning prepared scrapes of the routes one by one (the last one repeatedly).
+    None in the script is a failed scrape. Changed rides are the ones which were not in the previous scrape.
+    """
+
+    def __init__(self, scripts):
+        self.scripts = scripts      # (id_from, id_to) => [rides, ...]
+        self.scraped = []           # Routes in the order of the scrapes
+        self.city_threads = []      # Threads which scraped city IDs
+        self.snapshots = {}
+        self._lock = threading.Lock()
+
+    def get_rides_changes(self, id_from, id_to, input_data):
+        with self._lock:
+            self.scraped.append((id_from, id_to))
+            script = self.scripts[(id_from, id_to)]
+            rides = script.pop(0) if len(script) > 1 else script[0]
+            if rides is None:
+                raise IOError('Upstream error')
+            known_rides = self.snapshots.get((id_from, id_to), [])
+            self.snapshots[(id_from, id_to)] = rides
+            return rides, [ride for ride in rides if ride not in known_rides]
+
+    def forget_route(self, id_from, id_to, departure_date):
+        with self._lock:
+            self.snapshots.pop((id_from, id_to), None)
+
+    def get_all_city_ids(self):
+        self.city_threads.append(threading.current_thread())
+        raise IOError('Upstream error')
+
+
+class TestSeatWatcher(unittest.TestCase):
+    """
+    Check polling of the watches with a scripted parser (rides of tomorrow, polls every few milliseconds).
+    """
+
+    def setUp(self):
+        self.tomorrow = datetime.datetime.combine(datetime.date.today() + datetime.timedelta(days=1), datetime.time())
+        self.parser = ScriptedParser({})
+        self.getter = RidesGetter({'backend': 'memory'})
+        self.getter._create_sa_parser = lambda: self.parser
+        self.getter.cache.set_many({'city_id_praha': PRAHA, 'city_id_brno': BRNO, 'city_id_ostrava': OSTRAVA})
+        self.watcher = SeatWatcher(self.getter, workers=2, min_interval=0.005, max_interval=0.02, sold_out_factor=2)
+        self.fired = []     # (watch ID, departures of the rides)
+
+    def add_watch(self, to_city=u'Brno', min_seats=1, departure_time=None):
+        watch_input = {'from': u'Praha', 'to': to_city, 'departure': self.tomorrow}
+        return self.watcher.add_watch(watch_input, min_seats, self.callback, departure_time)
+
+    def callback(self, watch, rides):
+        self.fired.append((watch['id'], [ride['departure'][-5:] for ride in rides]))
+
+    def run_in_thread(self, keep_running=True):
+        thread = threading.Thread(target=self.watcher.run, kwargs={'keep_running': keep_running})
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def run_watcher(self):
+        """
+        Run the watcher until there are no watches left (it fails instead of hanging).
+        """
+        thread = self.run_in_thread(keep_running=False)
+        thread.join(5)
+        if thread.is_alive():
+            self.watcher.stop()
+            self.fail('The watcher did not finish.')
+
+    def wait_for(self, condition):
+        deadline = time.time() + 5
+        while not condition() and time.time() < deadline:
+            time.sleep(0.005)
+        self.assertTrue(condition())
+
+    def test_one_scrape_per_route(self):
+        """
+        Watches of the same route share its scrapes. Every watch fires once, when its seats are free.
+        """
+        self.parser.scripts = {
+            (PRAHA, BRNO): [make_rides(self.tomorrow, [0, 0]), make_rides(self.tomorrow, [0, 3]),
+                                   make_rides(self.tomorrow, [5, 3])],
+            (PRAHA, OSTRAVA): [make_rides(self.tomorrow, [1], OSTRAVA)],
+        }
+        watch_ids = [self.add_watch(min_seats=seats) for seats in (1, 2, 5)] + [self.add_watch(u'Ostrava')]
+        self.run_watcher()
+        self.assertEqual(sorted(self.fired), sorted([
+            (watch_ids[0], ['10:00']), (watch_ids[1], ['10:00']), (watch_ids[2], ['08:00']),
+            (watch_ids[3], ['08:00']),
+        ]))
+        self.assertEqual(self.parser.scraped.count((PRAHA, BRNO)), 3)
+        self.assertEqual(self.parser.scraped.count((PRAHA, OSTRAVA)), 1)
+        # All routes are dropped and forgotten by the parser.
+        self.assertEqual(self.watcher.routes, {})
+        self.assertEqual(self.parser.snapshots, {})
+
+    def test_departure_time(self):
+        """
+        A watch of one ride ignores free seats of the other rides.
+        """
+        self.parser.scripts = {(PRAHA, BRNO): [make_rides(self.tomorrow, [4, 0]), make_rides(self.tomorrow, [4, 2])]}
+        watch_id = self.add_watch(departure_time='10:00')
+        self.run_watcher()
+        self.assertEqual(self.fired, [(watch_id, ['10:00'])])
+        self.assertEqual(len(self.parser.scraped), 2)
+
+    def test_remove_watch_and_stop(self):
+        """
+        A removed watch never fires and its route is dropped. stop() ends the loop even if there are watches left.
+        """
+        self.parser.scripts = {
+            (PRAHA, BRNO): [make_rides(self.tomorrow, [0])],
+            (PRAHA, OSTRAVA): [make_rides(self.tomorrow, [0], OSTRAVA)],
+        }
+        thread = self.run_in_thread()
+        removed_id = self.add_watch()
+        self.add_watch(u'Ostrava')
+        self.wait_for(lambda: (PRAHA, BRNO) in self.parser.scraped)
+        self.watcher.remove_watch(removed_id)
+        self.wait_for(lambda: len(self.watcher.routes) == 1)
+        self.assertEqual(self.watcher.routes.keys()[0][:2], (PRAHA, OSTRAVA))
+        self.watcher.stop()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(self.fired, [])
+
+    def test_empty_or_failed_scrape(self):
+        """
+        A scrape without rides or with an error does not drop the watches, the route is scraped again.
+        """
+        self.parser.scripts = {(PRAHA, BRNO): [[], None, make_rides(self.tomorrow, [3])]}
+        watch_id = self.add_watch()
+        self.run_watcher()
+        self.assertEqual(self.fired, [(watch_id, ['08:00'])])
+        self.assertEqual(len(self.parser.scraped), 3)
+
+    def test_departed_rides(self):
+        """
+        Watches whose rides already departed are dropped without firing.
+        """
+        today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+        self.parser.scripts = {(PRAHA, BRNO): [make_rides(today - datetime.timedelta(days=1), [3])]}
+        self.add_watch()
+        self.run_watcher()
+        self.assertEqual(self.fired, [])
+        self.assertEqual(self.watcher.routes, {})
+
+    def test_failing_callback(self):
+        """
+        An error in a callback is reported and the other watches are still notified.
+        """
+        self.parser.scripts = {
+            (PRAHA, BRNO): [make_rides(self.tomorrow, [1])],
+            (PRAHA, OSTRAVA): [make_rides(self.tomorrow, [0], OSTRAVA), make_rides(self.tomorrow, [1], OSTRAVA)],
+        }
+        self.watcher.add_watch({'from': u'Praha', 'to': u'Brno', 'departure': self.tomorrow}, 1, lambda w, r: 1 / 0)
+        watch_id = self.add_watch(u'Ostrava')
+        self.run_watcher()
+        self.assertEqual(self.fired, [(watch_id, ['08:00'])])
+
+    def test_city_ids_in_main_loop(self):
+        """
+        City IDs missing in the cache are scraped by the main loop, not by the thread which adds the watch.
+        A watch whose cities cannot be found is not added.
+        """
+        self.getter.sa_parser = self.parser
+        self.parser.scripts = {(PRAHA, BRNO): [make_rides(self.tomorrow, [1])]}
+        self.watcher.add_watch({'from': u'Praha', 'to': u'Plzeň', 'departure': self.tomorrow}, 1, self.callback)
+        watch_id = self.add_watch()
+        self.assertEqual(self.parser.city_threads, [])
+        thread = self.run_in_thread()
+        self.wait_for(lambda: self.fired)
+        self.watcher.stop()
+        thread.join(5)
+        self.assertEqual(self.parser.city_threads, [thread])
+        self.assertEqual(self.fired, [(watch_id, ['08:00'])])
+
+    def test_interval(self):
+        """
+        The interval grows with the time to the first watched ride up to max_interval.
+        Then it is multiplied by sold_out_factor if all watched rides are sold out.
+        """
+        watcher = SeatWatcher(self.getter, min_interval=30, max_interval=900, sold_out_factor=4)
+        now = datetime.datetime.now()
+
+        def rides_in(hours, seats=1):
+            departure = (now + datetime.timedelta(hours=hours)).strftime('%Y-%m-%d %H:%M')
+            return [{'departure': departure, 'seats': seats}]
+        self.assertEqual(watcher._get_interval(now, rides_in(1)), 30)
+        self.assertAlmostEqual(watcher._get_interval(now, rides_in(10)), 150, delta=1)
+        self.assertAlmostEqual(watcher._get_interval(now, rides_in(10, 0)), 600, delta=4)
+        self.assertAlmostEqual(watcher._get_interval(now, rides_in(30) + rides_in(10)), 150, delta=1)
+        self.assertEqual(watcher._get_interval(now, rides_in(100)), 900)
+        self.assertEqual(watcher._get_interval(now, rides_in(100, 0)), 3600)
+        # Nothing to watch, or unknown rides
+        self.assertIsNone(watcher._get_interval(now, []))
+        self.assertEqual(watcher._get_interval(now + datetime.timedelta(hours=1), None), 30)
+        self.assertIsNone(watcher._get_interval(now - datetime.timedelta(days=2), None))
+
+
+if __name__ == '__main__':
+    unittest.main()
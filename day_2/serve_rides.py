@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Production server of the rides API. Requests are handled by greenlets (gevent), so one process serves
+thousands of open connections. Redis is cooperative (monkey patched sockets) and shared through one
+connection pool per process. Scrapes use pycurl (Grab), which would block the event loop, so they run
+in a pool of native threads - its size caps the number of concurrent upstream scrapes.
+A single server can use an in-process cache instead of Redis (configs/cache.json, see src/CacheBackend.py).
+
+The same route is scraped only once at a time. When cached rides are stale (older than --fresh seconds),
+they are served right away and refreshed in the background (stale-while-revalidate).
+
+Usage: python serve_rides.py [--port 5000] [--scrapes 8] [--timeout 20] [--fresh 600]
+"""
+if __name__ == '__main__':
+    # Before anything else is imported. Imported (i.e. by tests), the module does not patch anything.
+    from gevent import monkey
+    monkey.patch_all()
+
+import os
+import json
+import argparse
+
+import gevent
+from gevent.event import AsyncResult
+from gevent.pywsgi import WSGIServer
+from gevent.threadpool import ThreadPool
+from flask import Flask
+from flask import Response
+from flask import request
+
+from src.RidesGetter import RidesGetter
+
+app = Flask(__name__)
+app.config['PROPAGATE_EXCEPTIONS'] = True
+
+# Set by configure()
+r_getter = None
+scrape_pool = None
+scrape_timeout = None
+in_progress = {}    # running scrapes. connection key => AsyncResult
+
+
+def parse_args():
+    arg_parser = argparse.ArgumentParser(description='Rides API server.')
+    arg_parser.add_argument('--host', default='0.0.0.0')
+    arg_parser.add_argument('--port', type=int, default=5000)
+    arg_parser.add_argument('--scrapes', type=int, default=8, help='Maximal number of concurrent upstream scrapes.')
+    arg_parser.add_argument('--timeout', type=float, default=20, help='Maximal time to wait for a scrape (s).')
+    arg_parser.add_argument('--fresh', type=int, default=600, help='Cached rides older than this are revalidated (s).')
+    arg_parser.add_argument('--redis-connections', type=int, default=50, help='Size of the Redis connection pool.')
+    return arg_parser.parse_args()
+
+
+def configure(rides_getter, scrapes=8, timeout=20):
+    """
+    Set up the server (called by main() or tests).
+
+    Args:
+        rides_getter (RidesGetter): Cache and parsers of the server.
+        scrapes (int, optional): Maximal number of concurrent upstream scrapes.
+        timeout (float, optional): Maximal time to wait for a scrape (s).
+    """
+    global r_getter, scrape_pool, scrape_timeout
+    r_getter = rides_getter
+    scrape_pool = ThreadPool(scrapes)
+    scrape_timeout = timeout
+    in_progress.clear()
+
+
+def run_in_pool(method_name, *method_args):
+    """
+    Call a parser method in the thread pool (with the parser of the pool thread).
+    Returns AsyncResult, waiting for it does not block other greenlets.
+    """
+    def call():
+        return getattr(r_getter.get_thread_parser(), method_name)(*method_args)
+    return scrape_pool.spawn(call)
+
+
+def refresh_rides(id_from, id_to, input_data, cached_rides=None):
+    """
+    Scrape the route and save it to the cache. If the route is already being scraped, the running scrape is reused.
+    The scrape finishes (and is cached) even if the client which started it timed out.
+    Rides equal to the cached ones are not written again, only their freshness is updated.
+    """
+    connection_key = r_getter._get_connection_key(id_from, id_to, input_data['departure'])
+    if connection_key in in_progress:
+        return in_progress[connection_key]
+    result = in_progress[connection_key] = AsyncResult()
+
+    def scrape():
+        try:
+            rides = run_in_pool('get_rides', id_from, id_to, input_data).get()
+            r_getter._store_rides(id_from, id_to, input_data['departure'], rides, rides != cached_rides)
+            result.set(rides)
+        except Exception as e:
+            result.set_exception(e)
+        finally:
+            del in_progress[connection_key]
+    gevent.spawn(scrape)
+    return result
+
+
+def get_city_ids(from_city_name, to_city_name):
+    id_from, id_to = r_getter._get_cached_city_ids(from_city_name, to_city_name)
+    if not id_from or not id_to:
+        cities = run_in_pool('get_all_city_ids').get(timeout=scrape_timeout)
+        id_from, id_to = r_getter._store_city_ids(cities, from_city_name, to_city_name)
+    return id_from, id_to
+
+
+# Search method
+@app.route("/search")
+def search():
+    input_data = {
+        'from': request.args.get("city_from", "all"),
+        'to': request.args.get("city_to", "all"),
+        'departure': request.args.get("date", '2017-01-01')
+    }
+    parsed_input = r_getter.parse_input(json.dumps(input_data))
+    try:
+        id_from, id_to = get_city_ids(parsed_input['from'], parsed_input['to'])
+        rides, is_fresh = r_getter.get_cached_rides(id_from, id_to, parsed_input['departure'])
+        if rides is None:
+            rides = refresh_rides(id_from, id_to, parsed_input).get(timeout=scrape_timeout)
+        elif not is_fresh:
+            refresh_rides(id_from, id_to, parsed_input, rides)
+    except gevent.Timeout:
+        return Response('Upstream timeout.', status=504)
+    return Response(json.dumps(rides or []), mimetype='application/json')
+
+
+def main():
+    args = parse_args()
+    cache_config = json.load(open('../configs/cache.json' if os.path.exists('../configs/cache.json') else '../configs/redis.json'))
+    if cache_config.get('backend', 'redis') == 'redis':
+        cache_config.setdefault('max_connections', args.redis_connections)
+    upstream_config = json.load(open('../configs/upstream.json')) if os.path.exists('../configs/upstream.json') else None
+    configure(RidesGetter(cache_config, parser_config=upstream_config, fresh_seconds=args.fresh), args.scrapes,
+              args.timeout)
+    print('Rides API listening on http://{0}:{1}'.format(args.host, args.port))
+    WSGIServer((args.host, args.port), app, log=None).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
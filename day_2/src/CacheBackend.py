@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+
+class CacheBackend(object):
+    """
+    Interface of the rides cache. Keys and values are strings (other values are converted like in Redis),
+    missing and expired keys are None. TTL is in seconds, None means forever.
+
+    Implementations: RedisCache, MemoryCache (in-process LRU), SqliteCache (on-disk).
+    """
+
+    def get_many(self, keys):
+        """
+        Args:
+            keys (list): Keys to get.
+
+        Returns:
+            List of values in the same order as the keys.
+        """
+        raise NotImplementedError
+
+    def set_many(self, mapping, ttl=None):
+        """
+        Args:
+            mapping (dict): Values to set. 'key' => 'value'
+            ttl (int|dict, optional): TTL of all the keys or of individual keys ('key' => ttl).
+        """
+        raise NotImplementedError
+
+    def get(self, key):
+        return self.get_many([key])[0]
+
+    def set(self, key, value, ttl=None):
+        self.set_many({key: value}, ttl)
+
+    @staticmethod
+    def from_config(config):
+        """
+        Create a backend by config. The backend module is imported only when it is used.
+
+        Args:
+            config (dict): Name of the backend ('backend': 'redis', 'memory' or 'sqlite') and its arguments.
+                Without 'backend', the config contains arguments of StrictRedis (i.e. configs/redis.json).
+
+        Raises:
+            ValueError: Unknown backend.
+        """
+        config = dict(config)
+        backend = config.pop('backend', 'redis')
+        if backend == 'redis':
+            from RedisCache import RedisCache
+            return RedisCache(**config)
+        if backend == 'memory':
+            from MemoryCache import MemoryCache
+            return MemoryCache(**config)
+        if backend == 'sqlite':
+            from SqliteCache import SqliteCache
+            return SqliteCache(**config)
+        raise ValueError('Unknown cache backend: {0}.'.format(backend))
+
+    @staticmethod
+    def _get_key_ttl(ttl, key):
+        return ttl.get(key) if isinstance(ttl, dict) else ttl
+
+    @staticmethod
+    def _to_string(value):
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        return value if isinstance(value, str) else str(value)
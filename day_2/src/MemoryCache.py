@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+import time
+import threading
+from collections import OrderedDict
+
+from CacheBackend import CacheBackend
+
+
+class MemoryCache(CacheBackend):
+    """
+    Cache in a dictionary of the process (no network round trip, i.e. for one server or tests).
+    When it is full, the least recently used keys are removed. Expired keys are removed when they are read.
+    """
+
+    def __init__(self, max_items=100000):
+        """
+        Args:
+            max_items (int, optional): Maximal number of keys.
+        """
+        self.max_items = max_items
+        self.items = OrderedDict()  # From the least recently used. 'key' => ('value', expiration timestamp or None)
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.time()
+        values = []
+        with self._lock:
+            for key in keys:
+                item = self.items.pop(key, None)
+                if item is None or (item[1] is not None and item[1] <= now):
+                    values.append(None)
+                    continue
+                self.items[key] = item
+                values.append(item[0])
+        return values
+
+    def set_many(self, mapping, ttl=None):
+        now = time.time()
+        with self._lock:
+            for key, value in mapping.items():
+                key_ttl = self._get_key_ttl(ttl, key)
+                self.items.pop(key, None)
+                self.items[key] = (self._to_string(value), now + key_ttl if key_ttl else None)
+            while len(self.items) > self.max_items:
+                self.items.popitem(last=False)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import json
+import struct
+import datetime
+
+
+class PackedRides(object):
+    """
+    Compact cache format of the rides of one route (used instead of JSON in the cache).
+    Route metadata (city IDs, names and date) is stored only once, the rides as packed columns:
+    departure and arrival (minutes from midnight of the departure date), type, price and free seats.
+    The blob is decoded only when the rides are needed (to_list() or to_json()).
+
+    Layout: MAGIC | meta length (H) | rides count (H) | meta JSON | departures (H) | arrivals (H) | types (B) |
+            prices (f) | seats (H)
+    """
+
+    MAGIC = 'RP1'
+    HEADER = struct.Struct('<HH')
+    TYPES = [None, 'bus', 'train', 'bus/train']
+
+    def __init__(self, blob):
+        self.blob = blob
+        self.meta_length, self.count = self.HEADER.unpack_from(blob, len(self.MAGIC))
+
+    def __len__(self):
+        return self.count
+
+    @classmethod
+    def is_packed(cls, value):
+        return bool(value) and value.startswith(cls.MAGIC)
+
+    @classmethod
+    def pack(cls, rides):
+        """
+        Pack rides of one route.
+
+        Args:
+            rides (list): Rides from StudentAgencyParser (all of them with the same route and date).
+
+        Returns:
+            Packed rides (str).
+        """
+        first_ride = rides[0]
+        route_date = datetime.datetime.strptime(first_ride['departure'][:10], '%Y-%m-%d')
+        meta = json.dumps([first_ride['from'], first_ride['to'], first_ride['from_name'], first_ride['to_name'],
+                           first_ride['departure'][:10]])
+        n = len(rides)
+        return ''.join([
+            cls.MAGIC,
+            cls.HEADER.pack(len(meta), n),
+            meta,
+            struct.pack('<%dH' % n, *[cls._to_minutes(route_date, r['departure']) for r in rides]),
+            struct.pack('<%dH' % n, *[cls._to_minutes(route_date, r['arrival']) for r in rides]),
+            struct.pack('<%dB' % n, *[cls.TYPES.index(r.get('type')) for r in rides]),
+            struct.pack('<%df' % n, *[r['price'] for r in rides]),
+            struct.pack('<%dH' % n, *[r['seats'] for r in rides]),
+        ])
+
+    def to_list(self):
+        """
+        Decode the rides to the same dictionaries as returned by StudentAgencyParser.
+        """
+        n = self.count
+        offset = len(self.MAGIC) + self.HEADER.size
+        id_from, id_to, from_name, to_name, date_str = json.loads(self.blob[offset:offset + self.meta_length])
+        offset += self.meta_length
+        columns = []
+        for column_format in ('H', 'H', 'B', 'f', 'H'):
+            column = struct.Struct('<%d%s' % (n, column_format))
+            columns.append(column.unpack_from(self.blob, offset))
+            offset += column.size
+        route_date = datetime.datetime.strptime(date_str, '%Y-%m-%d')
+        all_rides = []
+        for departure, arrival, ride_type, price, seats in zip(*columns):
+            data = {
+                'from': id_from,
+                'to': id_to,
+                'departure': (route_date + datetime.timedelta(minutes=departure)).strftime('%Y-%m-%d %H:%M'),
+                'arrival': (route_date + datetime.timedelta(minutes=arrival)).strftime('%Y-%m-%d %H:%M'),
+                'price': price,
+                'from_name': from_name,
+                'to_name': to_name,
+                'seats': seats,
+            }
+            if ride_type:
+                data['type'] = self.TYPES[ride_type]
+            all_rides.append(data)
+        return all_rides
+
+    def to_json(self):
+        return json.dumps(self.to_list())
+
+    @staticmethod
+    def _to_minutes(route_date, time_str):
+        delta = datetime.datetime.strptime(time_str, '%Y-%m-%d %H:%M') - route_date
+        return delta.days * 1440 + delta.seconds // 60
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from redis import StrictRedis
+
+from CacheBackend import CacheBackend
+
+
+class RedisCache(CacheBackend):
+    """
+    Cache in Redis (shared by all processes and machines). Bulk operations take one round trip.
+    """
+
+    def __init__(self, **redis_config):
+        """
+        Args:
+            redis_config: Arguments of StrictRedis.
+        """
+        self.redis = StrictRedis(**redis_config)
+
+    def get_many(self, keys):
+        return self.redis.mget(keys) if keys else []
+
+    def set_many(self, mapping, ttl=None):
+        pipe = self.redis.pipeline(transaction=False)
+        for key, value in mapping.items():
+            pipe.set(key, value, ex=self._get_key_ttl(ttl, key))
+        pipe.execute()
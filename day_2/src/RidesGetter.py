@@ -2,20 +2,57 @@
 import re
 import datetime
 import json
+import threading
 
-from unidecode import unidecode
-from redis import StrictRedis
-
-from StudentAgencyParser import StudentAgencyParser
-from SmsMailer import SmsMailer
+from PackedRides import PackedRides
 
 
 class RidesGetter(object):
+    """
+    Get rides from the cache or scrape them. Clients (sa_parser, cache, sms_mailer, scrape_pool) and their modules
+    are created on first use, so i.e. a cache hit never imports or sets up the scraping and SMS stack.
+    """
 
-    def __init__(self, redis_config, sms_config):
-        self.sa_parser = StudentAgencyParser()
-        self.redis = StrictRedis(**redis_config)
-        self.sms_mailer = SmsMailer(**sms_config)
+    LAZY_CLIENTS = ('sa_parser', 'cache', 'sms_mailer', 'scrape_pool')
+
+    def __init__(self, cache_config, sms_config=None, parser_config=None, fresh_seconds=None, scrape_workers=4):
+        """
+        Args:
+            cache_config (dict): Cache backend and its arguments (see CacheBackend.from_config()).
+                Arguments of StrictRedis are enough for the Redis backend (i.e. configs/redis.json).
+            sms_config (dict, optional): Arguments of SmsMailer. No SMS can be sent if not set.
+            parser_config (dict, optional): Arguments of StudentAgencyParser (i.e. base URLs).
+            fresh_seconds (int, optional): How long are scraped rides considered fresh (see get_cached_rides()).
+                Rides stay in the cache after that, but they should be revalidated.
+            scrape_workers (int, optional): Maximal number of parallel scrapes of get_rides_batch().
+        """
+        self.cache_config = cache_config
+        self.sms_config = sms_config
+        self.parser_config = parser_config or {}
+        self.fresh_seconds = fresh_seconds
+        self.scrape_workers = scrape_workers
+        self._clients_lock = threading.Lock()
+        self._thread_parsers = threading.local()
+
+    def __getattr__(self, name):
+        """
+        Create a lazy client on first access. Then it is a normal attribute (no overhead, can be replaced).
+        """
+        if name not in self.LAZY_CLIENTS:
+            raise AttributeError(name)
+        with self._clients_lock:
+            if name not in self.__dict__:
+                self.__dict__[name] = getattr(self, '_create_' + name)()
+        return self.__dict__[name]
+
+    def get_thread_parser(self):
+        """
+        Parser of the current thread, created on first use. Every thread has its own parser, because Grab
+        is not thread-safe (sa_parser is shared, so it can be used only by one thread).
+        """
+        if not hasattr(self._thread_parsers, 'parser'):
+            self._thread_parsers.parser = self._create_sa_parser()
+        return self._thread_parsers.parser
 
     def parse_input(self, json_string):
         json_dict = json.loads(json_string)
@@ -29,56 +66,181 @@ class RidesGetter(object):
         # Get city IDs
         id_from, id_to = self._get_two_city_ids(from_city_name, to_city_name)
 
-        # Search Redis for connection
-        connection_key = 'connection_{0}_{1}_{2}'.format(id_from, id_to, departure_date.strftime('%Y%m%d'))
-        rides = self.redis.get(connection_key)
+        # Search the cache for connection
+        connection_key = self._get_connection_key(id_from, id_to, departure_date)
+        rides = self.cache.get(connection_key)
 
         if not rides or rides == '[]':
-            print('Connection data not found in Redis.')
-            # Get data from Studentagency
-            rides = self.sa_parser.get_rides(id_from, id_to, input_data)
-            # Save it to Redis
+            print('Connection data not found in cache.')
+            # Get data from Studentagency and save it to the cache
+            rides = self._scrape_rides(self.sa_parser, id_from, id_to, input_data)
             if rides:
                 rides = json.dumps(rides)
-                self.redis.set(connection_key, rides)
+        elif PackedRides.is_packed(rides):
+            rides = PackedRides(rides).to_json()
 
         # Result
         return rides
 
+    def get_rides_batch(self, queries):
+        """
+        Get rides for several queries at once (i.e. one route for a range of dates).
+        Cached connections are loaded at once (one MGET in Redis), the missing ones are scraped in parallel
+        (in scrape_pool, which is shared by all calls, so its threads and their parsers are reused).
+
+        Args:
+            queries (list): Parsed inputs - [{'from': u'Praha', 'to': u'Brno', 'departure': datetime}, ...]
+
+        Returns:
+            List of ride lists, one for every query (in the same order).
+        """
+        # Get city IDs (once for every pair of cities)
+        city_ids = {}
+        for query in queries:
+            if (query['from'], query['to']) not in city_ids:
+                city_ids[(query['from'], query['to'])] = self._get_two_city_ids(query['from'], query['to'])
+        routes = [city_ids[(q['from'], q['to'])] for q in queries]
+
+        # Search the cache for all connections
+        connection_keys = [self._get_connection_key(id_from, id_to, q['departure'])
+                           for (id_from, id_to), q in zip(routes, queries)]
+        cached_rides = self.cache.get_many(connection_keys)
+        all_rides = [self._decode_rides(rides) for rides in cached_rides]
+
+        # Get the missing data from Studentagency
+        missing = [i for i, rides in enumerate(all_rides) if rides is None]
+        if missing:
+            print('{0} of {1} connections not found in cache.'.format(len(missing), len(queries)))
+
+            def scrape(i):
+                return self._scrape_rides(self.get_thread_parser(), routes[i][0], routes[i][1], queries[i])
+
+            for i, rides in zip(missing, self.scrape_pool.map(scrape, missing)):
+                all_rides[i] = rides
+
+        # Result
+        return all_rides
+
     def check_seats(self, input_data, book_free_seats, mobile_send_number):
+        """
+        The SMS is only queued (errors are reported by the mailer). Call sms_mailer.flush() before exiting,
+        otherwise queued messages may not be sent.
+        """
+        if self.sms_mailer is None:
+            return 'Error while sending SMS: sms_config is not set'
         id_from, id_to = self._get_two_city_ids(input_data['from'], input_data['to'])
         #res_number = self.sa_parser.get_rides(id_from, id_to, input_data, book_free_seats)
         res_number = 24543
         msg = ('Seat freed for bus on {0}. Reservation: {1}'
                .format(input_data['departure'].strftime('%d.%m.%Y'), res_number))
-        resp_code = self.sms_mailer.send_sms(msg, mobile_send_number)
-        if resp_code != 200:
-            return 'Error while sending SMS: {0}'.format(resp_code)
+        self.sms_mailer.queue_sms(msg, mobile_send_number)
         print msg
         return res_number
 
 
+    def get_cached_rides(self, id_from, id_to, departure_date):
+        """
+        Load rides from the cache together with their freshness (one bulk get).
+
+        Returns:
+            Tuple (rides, is_fresh). Rides are a list or None if not cached.
+            Without fresh_seconds, all cached rides are fresh.
+        """
+        connection_key = self._get_connection_key(id_from, id_to, departure_date)
+        cached_value, fresh_mark = self.cache.get_many([connection_key, connection_key + '_fresh'])
+        return self._decode_rides(cached_value), bool(fresh_mark) or not self.fresh_seconds
+
+    def _create_sa_parser(self):
+        from StudentAgencyParser import StudentAgencyParser
+        return StudentAgencyParser(**self.parser_config)
+
+    def _create_cache(self):
+        from CacheBackend import CacheBackend
+        return CacheBackend.from_config(self.cache_config)
+
+    def _create_scrape_pool(self):
+        from multiprocessing.pool import ThreadPool
+        return ThreadPool(self.scrape_workers)
+
+    def _create_sms_mailer(self):
+        """
+        No SMS can be sent without sms_config (None is returned).
+        """
+        if not self.sms_config:
+            return None
+        from SmsMailer import SmsMailer
+        return SmsMailer(**self.sms_config)
+
+    def _get_connection_key(self, id_from, id_to, departure_date):
+        return 'connection_{0}_{1}_{2}'.format(id_from, id_to, departure_date.strftime('%Y%m%d'))
+
+    def _scrape_rides(self, sa_parser, id_from, id_to, input_data):
+        """
+        Scrape rides with the given parser and save them to the cache (see _store_rides()).
+        """
+        rides = sa_parser.get_rides(id_from, id_to, input_data)
+        self._store_rides(id_from, id_to, input_data['departure'], rides)
+        return rides
+
+    def _store_rides(self, id_from, id_to, departure_date, rides, changed=True):
+        """
+        Save rides to the cache (one bulk set). If they did not change since the last scrape,
+        only their freshness is updated. The same holds if no rides were scraped (i.e. an upstream error):
+        cached rides are kept and the route is not revalidated again until they are stale.
+        """
+        connection_key = self._get_connection_key(id_from, id_to, departure_date)
+        values = {}
+        if rides and changed:
+            values[connection_key] = PackedRides.pack(rides)
+        if self.fresh_seconds:
+            values[connection_key + '_fresh'] = 1
+        if values:
+            self.cache.set_many(values, {connection_key + '_fresh': self.fresh_seconds})
+
+    @staticmethod
+    def _decode_rides(cached_value):
+        """
+        Decode rides from the cache (packed or JSON). Returns None if there are no rides.
+        """
+        if PackedRides.is_packed(cached_value):
+            return PackedRides(cached_value).to_list() or None
+        if cached_value and cached_value != '[]':
+            return json.loads(cached_value)
+        return None
+
     def _get_two_city_ids(self, from_city_name, to_city_name):
-        # Search Redis for city IDs
-        id_from = self.redis.get('city_id_{0}'.format(self.slugify(from_city_name)))
-        id_to = self.redis.get('city_id_{0}'.format(self.slugify(to_city_name)))
+        # Search the cache for city IDs
+        id_from, id_to = self._get_cached_city_ids(from_city_name, to_city_name)
 
-        # If IDs were not found in Redis.
+        # If IDs were not found in the cache.
         if not id_from or not id_to:
-            print('Cities not found in Redis.')
+            print('Cities not found in cache.')
             cities = self.sa_parser.get_all_city_ids()
-            id_from, id_to = self.sa_parser.get_two_city_ids(cities, from_city_name, to_city_name)
-            self.redis.set('city_id_{0}'.format(self.slugify(from_city_name)), id_from)
-            self.redis.set('city_id_{0}'.format(self.slugify(to_city_name)), id_to)
-            return id_from, id_to
+            return self._store_city_ids(cities, from_city_name, to_city_name)
         else:
             return id_from, id_to
 
+    def _get_cached_city_ids(self, from_city_name, to_city_name):
+        return tuple(self.cache.get_many(['city_id_{0}'.format(self.slugify(from_city_name)),
+                                      'city_id_{0}'.format(self.slugify(to_city_name))]))
+
+    def _store_city_ids(self, cities, from_city_name, to_city_name):
+        """
+        Find IDs of the two cities in the list of all cities and save them to the cache.
+        """
+        id_from, id_to = self.sa_parser.get_two_city_ids(cities, from_city_name, to_city_name)
+        self.cache.set_many({
+            'city_id_{0}'.format(self.slugify(from_city_name)): id_from,
+            'city_id_{0}'.format(self.slugify(to_city_name)): id_to,
+        })
+        return id_from, id_to
+
 
     def slugify(self, s):
         """
         Remove diacritic from input string and replace all non alphanumeric symbols with underscore.
         Frýdek-Místek -> frydek_mistek
         """
+        from unidecode import unidecode
         s = unidecode(s).lower()
         return re.sub(r'\W+', '_', s)
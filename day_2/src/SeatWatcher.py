@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+import datetime
+import heapq
+import threading
+import time
+import Queue
+
+
+class SeatWatcher(object):
+    """
+    Poll seat availability for many watches at once.
+    Watches are grouped by route (from, to, departure date), so one scrape serves every watcher of that route.
+    Scrapes run in worker threads, the main loop only schedules routes and dispatches results.
+    Watches can be added and removed from any thread, also while the watcher runs: the changes are sent
+    to the main loop as events, so only the main loop changes the routes and the schedule.
+    A route is always scraped by the same worker, whose parser remembers the last scrape of the route. Watchers
+    are then notified (and the cache updated) only with rides which changed since the last scrape.
+    """
+
+    def __init__(self, rides_getter, workers=4, min_interval=30, max_interval=900, sold_out_factor=4):
+        """
+        Args:
+            rides_getter (RidesGetter): Used for translating city names to IDs, parsers of the workers
+                and the cache.
+            workers (int, optional): Number of threads which scrape the routes.
+            min_interval (int, optional): Shortest polling interval of a route (in seconds), used close to departure.
+            max_interval (int, optional): Longest polling interval of a route (in seconds).
+            sold_out_factor (int, optional): The interval is multiplied by this number when all watched rides
+                are sold out (also the maximal interval).
+        """
+        self.rides_getter = rides_getter
+        self.workers = workers
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.sold_out_factor = sold_out_factor
+        self.routes = {}        # Watched routes. (id_from, id_to, 'YYYYMMDD') => {'input_data': ..., 'watches': ...}
+        self.schedule = []      # Heap of next polls. [(timestamp, route_key), ...]
+        self.in_flight = set()  # Routes being scraped right now.
+        self._next_watch_id = 0
+        self._watch_id_lock = threading.Lock()
+        self._tasks = [Queue.Queue() for _ in range(workers)]
+        self._events = Queue.Queue()  # For the main loop. [('add' | 'remove' | 'result' | 'stop', data), ...]
+        self._stopped = False
+        self._threads = []
+
+    #### PUBLIC METHODS
+
+    def add_watch(self, input_data, min_seats, callback, departure_time=None):
+        """
+        Start watching a route. The watch fires only once and is removed after that.
+        It can be called from any thread, the watch is registered by the main loop (see _add_watch()).
+
+        Args:
+            input_data (dict): Parsed input - {'from': u'Praha', 'to': u'Brno', 'departure': datetime}.
+            min_seats (int): The watch fires when a ride has at least this number of free seats.
+            callback (function): Called as callback(watch, rides) with the rides which satisfy the watch.
+            departure_time (str, optional): Watch only the ride departing at this time (HH:MM). All rides if not set.
+
+        Returns:
+            ID of the watch (int).
+        """
+        with self._watch_id_lock:
+            self._next_watch_id += 1
+            watch_id = self._next_watch_id
+        self._events.put(('add', {
+            'id': watch_id,
+            'input_data': input_data,
+            'min_seats': min_seats,
+            'departure_time': departure_time,
+            'callback': callback,
+            'checked': False,   # True after the watch was checked against all rides of the route.
+        }))
+        return watch_id
+
+    def remove_watch(self, watch_id):
+        """
+        Stop watching (can be called from any thread). The route is dropped when its last watch is removed.
+        """
+        self._events.put(('remove', watch_id))
+
+    def stop(self):
+        """
+        Stop the main loop (can be called from any thread). Remaining watches are not checked anymore.
+        """
+        self._events.put(('stop', None))
+
+    def run(self, keep_running=False):
+        """
+        Main loop. Runs until there are no watches left (all fired, removed or their rides departed).
+
+        Args:
+            keep_running (bool, optional): If true, the loop waits for new watches until stop() is called.
+        """
+        self._stopped = False
+        self._start_workers()
+        try:
+            while not self._stopped and (keep_running or self.routes or self.in_flight or not self._events.empty()):
+                self._dispatch_due_routes()
+                # Wait for an event, but not longer than to the next scheduled poll.
+                timeout = self._seconds_to_next_poll()
+                try:
+                    event, data = self._events.get(timeout=timeout)
+                except Queue.Empty:
+                    continue
+                self._process_event(event, data)
+        finally:
+            self._stop_workers()
+
+    #### PRIVATE METHODS
+
+    def _start_workers(self):
+        for tasks in self._tasks:
+            thread = threading.Thread(target=self._worker, args=(tasks,))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _stop_workers(self):
+        for tasks in self._tasks:
+            tasks.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _worker(self, tasks):
+        """
+        Scrape routes from the task queue (with the parser of the worker thread).
+        """
+        parser = self.rides_getter.get_thread_parser()
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            route_key, input_data = task
+            if input_data is None:
+                parser.forget_route(route_key[0], route_key[1], self._get_route_date(route_key))
+                continue
+            try:
+                rides, changed_rides = parser.get_rides_changes(route_key[0], route_key[1], input_data)
+            except Exception as e:
+                print('Scraping of route {0} failed: {1}'.format(route_key, e))
+                rides, changed_rides = None, []
+            self._events.put(('result', (route_key, rides, changed_rides)))
+
+    def _process_event(self, event, data):
+        if event == 'result':
+            self._process_result(*data)
+        elif event == 'add':
+            self._add_watch(data)
+        elif event == 'remove':
+            self._remove_watch(data)
+        elif event == 'stop':
+            self._stopped = True
+
+    def _add_watch(self, watch):
+        """
+        Register a watch. City IDs are resolved here and not in add_watch(): if they are not cached, they are
+        scraped by sa_parser of the rides getter, which must not be used by more threads.
+        """
+        input_data = watch['input_data']
+        try:
+            id_from, id_to = self.rides_getter._get_two_city_ids(input_data['from'], input_data['to'])
+        except Exception as e:
+            print('Watch {0} was not added, its city IDs were not found: {1}'.format(watch['id'], e))
+            return
+        route_key = (id_from, id_to, input_data['departure'].strftime('%Y%m%d'))
+        if route_key not in self.routes:
+            self.routes[route_key] = {'input_data': watch['input_data'], 'watches': {}}
+            heapq.heappush(self.schedule, (time.time(), route_key))
+        self.routes[route_key]['watches'][watch['id']] = watch
+
+    def _remove_watch(self, watch_id):
+        for route_key, route in self.routes.items():
+            if watch_id in route['watches']:
+                del route['watches'][watch_id]
+                if not route['watches']:
+                    self._drop_route(route_key)
+                return
+
+    def _dispatch_due_routes(self):
+        now = time.time()
+        while self.schedule and self.schedule[0][0] <= now:
+            _, route_key = heapq.heappop(self.schedule)
+            # The route might have been removed in the meantime.
+            if route_key not in self.routes or route_key in self.in_flight:
+                continue
+            self.in_flight.add(route_key)
+            self._get_route_tasks(route_key).put((route_key, self.routes[route_key]['input_data']))
+
+    def _get_route_tasks(self, route_key):
+        return self._tasks[hash(route_key) % len(self._tasks)]
+
+    def _drop_route(self, route_key):
+        del self.routes[route_key]
+        # Let the worker forget the last scrape of the route.
+        self._get_route_tasks(route_key).put((route_key, None))
+
+    @staticmethod
+    def _get_route_date(route_key):
+        return datetime.datetime.strptime(route_key[2], '%Y%m%d')
+
+    def _seconds_to_next_poll(self):
+        if not self.schedule:
+            return self.max_interval
+        return max(0, self.schedule[0][0] - time.time())
+
+    def _process_result(self, route_key, rides, changed_rides):
+        self.in_flight.discard(route_key)
+        route = self.routes.get(route_key)
+        if route is None:
+            return
+        # Update the cache, if anything changed (watchers are notified even if the cache is not available).
+        if changed_rides:
+            try:
+                self.rides_getter._store_rides(route_key[0], route_key[1], route['input_data']['departure'], rides)
+            except Exception as e:
+                print('Rides of route {0} were not cached: {1}'.format(route_key, e))
+        # Notify watchers. A failed or empty scrape (i.e. an upstream error) is just retried later.
+        # New watches are checked against all rides. Watches whose rides already departed are dropped.
+        now = datetime.datetime.now()
+        watched_rides = None
+        if rides:
+            watched_rides = []
+            for watch_id, watch in route['watches'].items():
+                upcoming_rides = self._get_watched_rides(watch, rides, now)
+                if not upcoming_rides:
+                    del route['watches'][watch_id]
+                    continue
+                matching_rides = self._get_matching_rides(watch, changed_rides if watch['checked'] else rides, now)
+                watch['checked'] = True
+                if matching_rides:
+                    # A failing callback must not stop watching of the other routes.
+                    try:
+                        watch['callback'](watch, matching_rides)
+                    except Exception as e:
+                        print('Callback of watch {0} failed: {1}'.format(watch_id, e))
+                    del route['watches'][watch_id]
+                else:
+                    watched_rides.extend(upcoming_rides)
+        # Plan the next poll or drop the route.
+        interval = self._get_interval(route['input_data']['departure'], watched_rides)
+        if not route['watches'] or interval is None:
+            self._drop_route(route_key)
+        else:
+            heapq.heappush(self.schedule, (time.time() + interval, route_key))
+
+    def _get_interval(self, departure_date, watched_rides):
+        """
+        Compute polling interval of a route. Poll more often close to the departure of the first watched ride
+        and less often when all watched rides are sold out.
+
+        Args:
+            departure_date (datetime): Departure date of the route.
+            watched_rides (list): Not yet departed rides of the active watches (None if the scrape failed
+                or returned no rides).
+
+        Returns:
+            Interval in seconds or None if there is nothing to watch.
+        """
+        now = datetime.datetime.now()
+        if watched_rides is None:
+            # Rides are not known, the route is polled until the end of its day.
+            if now >= departure_date + datetime.timedelta(days=1):
+                return None
+            next_departure = departure_date
+        elif not watched_rides:
+            return None
+        else:
+            next_departure = datetime.datetime.strptime(min(r['departure'] for r in watched_rides), '%Y-%m-%d %H:%M')
+        hours_left = max(0, (next_departure - now).total_seconds() / 3600)
+        # Linear growth with time to departure: minimal interval 2 hours before departure.
+        interval = min(self.min_interval * max(1.0, hours_left / 2), self.max_interval)
+        if watched_rides and not any(r['seats'] for r in watched_rides):
+            interval *= self.sold_out_factor
+        return interval
+
+    @staticmethod
+    def _get_watched_rides(watch, rides, now):
+        """
+        Rides of the watch (with the watched departure time) which did not depart yet.
+        """
+        now_str = now.strftime('%Y-%m-%d %H:%M')
+        return [ride for ride in rides if ride['departure'] > now_str and
+                (not watch['departure_time'] or ride['departure'].endswith(watch['departure_time']))]
+
+    @staticmethod
+    def _get_matching_rides(watch, rides, now):
+        return [ride for ride in SeatWatcher._get_watched_rides(watch, rides, now)
+                if ride['seats'] >= watch['min_seats']]
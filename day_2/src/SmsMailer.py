@@ -1,26 +1,135 @@
 import json
-
-import requests
+import time
+import threading
+import Queue
 
 
 class SmsMailer(object):
+    """
+    Send SMS through the GoSMS API. One pooled HTTP session is used and the OAuth token is obtained lazily
+    and refreshed before it expires. The session (and the requests module) is created on the first request.
+    Messages can be queued: a background thread sends them in batches, recipients of the same message are merged
+    into one API call.
+    """
 
-    def __init__(self, client_id, client_secret):
-        post_data = {
-            'client_id': client_id,
-            'client_secret': client_secret,
-            'grant_type': 'client_credentials',
-        }
-        a_token = requests.post('https://app.gosms.cz/oauth/v2/token', post_data).text
-        self.a_token = json.loads(a_token)['access_token']
+    def __init__(self, client_id, client_secret, channel=185270, batch_size=100, batch_wait=1.0):
+        """
+        Args:
+            client_id (str): GoSMS OAuth client ID.
+            client_secret (str): GoSMS OAuth client secret.
+            channel (int, optional): GoSMS channel for sending the messages.
+            batch_size (int, optional): Maximal number of queued messages processed in one batch.
+            batch_wait (float, optional): How long to wait for more queued messages before sending a batch (in seconds).
+        """
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.channel = channel
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self._session = None
+        self._session_lock = threading.Lock()
+        self.a_token = None
+        self.token_expires = 0
+        self._token_lock = threading.Lock()
+        self._queue = Queue.Queue()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    @property
+    def session(self):
+        with self._session_lock:
+            if self._session is None:
+                import requests
+                self._session = requests.Session()
+            return self._session
+
+    @session.setter
+    def session(self, session):
+        self._session = session
+
+    def get_token(self, force_refresh=False):
+        """
+        Return a valid access token. A new one is requested only if there is none or it is about to expire.
+        """
+        with self._token_lock:
+            if force_refresh or self.a_token is None or time.time() > self.token_expires - 60:
+                post_data = {
+                    'client_id': self.client_id,
+                    'client_secret': self.client_secret,
+                    'grant_type': 'client_credentials',
+                }
+                token_data = json.loads(self.session.post('https://app.gosms.cz/oauth/v2/token', post_data).text)
+                self.a_token = token_data['access_token']
+                self.token_expires = time.time() + token_data.get('expires_in', 3600)
+            return self.a_token
 
     def send_sms(self, msg, to_mobile, test_mode=True):
+        """
+        Send one message right away.
+
+        Args:
+            msg (str): Text of the message.
+            to_mobile (str|list): Phone number or list of phone numbers.
+            test_mode (bool, optional): If true, the message is only validated by the API and not sent.
+
+        Returns:
+            HTTP status code of the API response.
+        """
         post_data = {
             'message': msg,
             'recipients': to_mobile,
-            'channel': 185270,
+            'channel': self.channel,
             #'expectedSendStart': ''
         }
         endpoint_url = 'https://app.gosms.cz/api/v1/messages/test' if test_mode else 'https://app.gosms.cz/api/v1/messages'
-        result = requests.post('{0}?access_token={1}'.format(endpoint_url, self.a_token), json.dumps(post_data))
+        result = self.session.post(endpoint_url, json.dumps(post_data), params={'access_token': self.get_token()})
+        # The token might have been revoked before its expiration.
+        if result.status_code == 401:
+            result = self.session.post(endpoint_url, json.dumps(post_data),
+                                       params={'access_token': self.get_token(force_refresh=True)})
         return result.status_code
+
+    def queue_sms(self, msg, to_mobile, test_mode=True):
+        """
+        Queue a message for sending in the background. The method never blocks on the API.
+        Parameters are the same as for send_sms().
+        """
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._send_queued)
+                self._thread.daemon = True
+                self._thread.start()
+        self._queue.put((msg, to_mobile, test_mode))
+
+    def flush(self):
+        """
+        Wait until all queued messages are sent (the sending thread is a daemon, it does not keep the process running).
+        """
+        self._queue.join()
+
+    def _send_queued(self):
+        while True:
+            batch = [self._queue.get()]
+            # Collect more messages for a while.
+            wait_until = time.time() + self.batch_wait
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(0, wait_until - time.time())))
+                except Queue.Empty:
+                    break
+            # Merge recipients of the same message.
+            recipients = {}
+            for msg, to_mobile, test_mode in batch:
+                numbers = recipients.setdefault((msg, test_mode), [])
+                for number in (to_mobile if isinstance(to_mobile, list) else [to_mobile]):
+                    if number not in numbers:
+                        numbers.append(number)
+            for (msg, test_mode), numbers in recipients.items():
+                try:
+                    resp_code = self.send_sms(msg, numbers, test_mode)
+                    if resp_code not in (200, 201):
+                        print('Error while sending SMS to {0}: {1}'.format(', '.join(numbers), resp_code))
+                except Exception as e:
+                    print('Error while sending SMS to {0}: {1}'.format(', '.join(numbers), e))
+            for _ in batch:
+                self._queue.task_done()
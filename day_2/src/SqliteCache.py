@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import time
+import sqlite3
+import threading
+
+from CacheBackend import CacheBackend
+
+
+class SqliteCache(CacheBackend):
+    """
+    Cache in a SQLite file (survives restarts, shared by the processes of one machine).
+    Expired keys are ignored when read and deleted when new keys are written.
+    """
+
+    MAX_VARIABLES = 500  # Keys in one SELECT (SQLite limits the number of query parameters).
+
+    def __init__(self, path='rides_cache.sqlite'):
+        """
+        Args:
+            path (str, optional): Path of the database file (':memory:' for a temporary database).
+        """
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.text_factory = str
+        self._lock = threading.Lock()
+        with self._lock, self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS cache '
+                                    '(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)')
+
+    def get_many(self, keys):
+        now = time.time()
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), self.MAX_VARIABLES):
+                chunk = keys[start:start + self.MAX_VARIABLES]
+                rows = self.connection.execute(
+                    'SELECT key, value FROM cache WHERE key IN ({0}) AND (expires IS NULL OR expires > ?)'
+                    .format(','.join('?' * len(chunk))), chunk + [now])
+                found.update((key, str(value)) for key, value in rows)
+        return [found.get(key) for key in keys]
+
+    def set_many(self, mapping, ttl=None):
+        now = time.time()
+        rows = []
+        for key, value in mapping.items():
+            key_ttl = self._get_key_ttl(ttl, key)
+            rows.append((key, buffer(self._to_string(value)), now + key_ttl if key_ttl else None))
+        with self._lock, self.connection:
+            self.connection.execute('DELETE FROM cache WHERE expires <= ?', (now,))
+            self.connection.executemany('INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)', rows)
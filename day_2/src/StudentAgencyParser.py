@@ -2,20 +2,47 @@
 import re
 import datetime
 import json
+import hashlib
 
-from unidecode import unidecode
-from grab import Grab
+from lxml import etree
 
 
 class StudentAgencyParser(object):
 
-    def __init__(self):
-        self.g = Grab()
+    def __init__(self, home_url='https://jizdenky.studentagency.cz', booking_url='https://jizdenky.regiojet.cz',
+                 data_url='https://www.studentagency.cz'):
+        """
+        Base URLs of the upstream sites can be changed, i.e. to point the parser to a local stub server.
+        """
+        self._g = None
+        self.home_url = home_url
+        self.booking_url = booking_url
+        self.data_url = data_url
         self.dtformat = '%Y%m%d'
+        # Compiled selectors and regexes for parsing of the routes panel.
+        self._rides_xpath = etree.XPath(
+            '//div[contains(concat(" ", normalize-space(@class), " "), " item_blue ")]'
+            '[starts-with(@*[name()="ybus:rowid"], $rowid_prefix)]'
+        )
+        self._icon_xpath = etree.XPath('./div[@class="col_icon"]/a/img')
+        self._number_re = re.compile(r'\d+')
+        self.ride_types = {'Autobus': 'bus', 'Vlak': 'train', 'Autobus / Vlak': 'bus/train'}
+        # Rows of the last scrape of every route (see get_rides_changes). (id_from, id_to, 'YYYYMMDD') => {hash: ride}
+        self.snapshots = {}
+
+    @property
+    def g(self):
+        """
+        Grab instance, created on the first request (parsing of saved pages does not need it).
+        """
+        if self._g is None:
+            from grab import Grab
+            self._g = Grab()
+        return self._g
 
     def get_all_city_ids(self, country_code='CZ'):
-        self.g.go('https://jizdenky.studentagency.cz')
-        all_dest_dict = self.g.go('https://www.studentagency.cz/data/wc/ybus-form/destinations-cs.json')
+        self.g.go(self.home_url)
+        all_dest_dict = self.g.go(self.data_url + '/data/wc/ybus-form/destinations-cs.json')
         cities = []
         for dest in all_dest_dict.json['destinations']:
             if dest['code'] == country_code:
@@ -35,86 +62,141 @@ class StudentAgencyParser(object):
         return id_from, id_to
 
     def get_rides(self, id_from, id_to, input_data, book_free_seats=False):
-        departure_date = input_data['departure']
+        self._load_rides_panel(id_from, id_to, input_data['departure'])
+        # Process response
+        return self._process_rides_response(id_from, id_to, input_data, book_free_seats)
+
+    def get_rides_changes(self, id_from, id_to, input_data):
+        """
+        Scrape rides of the route and compare them with the previous scrape of the same route by this parser.
+        Rows with the same HTML as last time are not parsed again.
+
+        Args:
+            id_from (str): ID of the source city.
+            id_to (str): ID of the destination city.
+            input_data (dict): Parsed input - {'from': u'Praha', 'to': u'Brno', 'departure': datetime}.
+
+        Returns:
+            Tuple (all_rides, changed_rides). Changed rides are the new ones and the ones with changed row
+            (i.e. seats or price). On the first scrape of the route, all rides are changed.
+        """
+        route_key = (id_from, id_to, input_data['departure'].strftime(self.dtformat))
+        known_rows = self.snapshots.get(route_key, {})
+        current_rows = {}
+        self._load_rides_panel(id_from, id_to, input_data['departure'])
+        all_rides = self.parse_rides_tree(self.g.doc.tree, id_from, id_to, input_data, known_rows, current_rows)
+        self.snapshots[route_key] = current_rows
+        changed_rides = [data for row_hash, data in current_rows.items() if row_hash not in known_rows]
+        changed_rides.sort(key=lambda r: r['departure'])
+        return all_rides, changed_rides
+
+    def forget_route(self, id_from, id_to, departure_date):
+        """
+        Drop the snapshot of the route (i.e. when the route is not watched anymore).
+        """
+        self.snapshots.pop((id_from, id_to, departure_date.strftime(self.dtformat)), None)
+
+    def _load_rides_panel(self, id_from, id_to, departure_date):
         # Homepage request
-        self.g.go('https://jizdenky.studentagency.cz')
+        self.g.go(self.home_url)
         # Request 1
         url = (
-            'https://jizdenky.regiojet.cz/Booking/from/{0}/to/{1}/tarif/REGULAR/departure/{2}/retdep/{3}/return/false'
+            self.booking_url + '/Booking/from/{0}/to/{1}/tarif/REGULAR/departure/{2}/retdep/{3}/return/false'
             .format(id_from, id_to, departure_date.strftime(self.dtformat), departure_date.strftime(self.dtformat))
         )
         self.g.go(url)
         # Request 2
         url = (
-            'https://jizdenky.regiojet.cz/Booking/from/{0}/to/{1}/tarif/REGULAR/departure/{2}/retdep/{3}/return/false'
+            self.booking_url + '/Booking/from/{0}/to/{1}/tarif/REGULAR/departure/{2}/retdep/{3}/return/false'
             '?1-1.IBehaviorListener.0-mainPanel-routesPanel&_=1474659041806'
             .format(id_from, id_to, departure_date.strftime(self.dtformat), departure_date.strftime(self.dtformat))
         )
         self.g.go(url)
-        # Process response
-        return self._process_rides_response(id_from, id_to, input_data, book_free_seats)
 
     def _process_rides_response(self, id_from, id_to, input_data, book_free_seats=False):
-        rides = self.g.css_list('div.item_blue[ybus\:rowid^="{0}"]'.format(input_data['departure'].strftime(self.dtformat)))
+        all_rides = self.parse_rides_tree(self.g.doc.tree, id_from, id_to, input_data)
+
+        #print('Number of rides: {0}'.format(len(all_rides)))
 
-        #print('Number of rides: {0}'.format(len(rides)))
+        # Book free seat? (Note: 0 == False, so the flag must be compared by identity.)
+        if book_free_seats is not False:
+            for r_n, data in enumerate(all_rides, start=1):
+                if data['seats'] == book_free_seats:
+                    print('Booking ticket! {0}'.format(str(data)))
+                    return self.create_reservation(id_from, id_to, input_data['departure'], r_n)
+        # Result
+        return all_rides
+
+    def parse_rides_tree(self, tree, id_from, id_to, input_data, known_rows=None, current_rows=None):
+        """
+        Extract rides from the routes panel. Every row is walked only once and all selectors are precompiled.
+
+        Args:
+            tree (lxml.html.HtmlElement): Parsed routes panel.
+            id_from (str): ID of the source city.
+            id_to (str): ID of the destination city.
+            input_data (dict): Parsed input - {'from': u'Praha', 'to': u'Brno', 'departure': datetime}.
+            known_rows (dict, optional): Rides parsed before, by hash of their row HTML. Known rows are not parsed again.
+            current_rows (dict, optional): If set, rides are hashed and added to it (hash of row HTML => ride).
+
+        Returns:
+            List of rides (dictionaries).
+        """
+        date_prefix = input_data['departure'].strftime('%Y-%m-%d')
+        rides = self._rides_xpath(tree, rowid_prefix=input_data['departure'].strftime(self.dtformat))
 
         all_rides = []
 
-        for r_n, ride in enumerate(rides, start=1):
+        for ride in rides:
+            if current_rows is not None:
+                row_hash = hashlib.md5(etree.tostring(ride)).digest()
+                if known_rows and row_hash in known_rows:
+                    current_rows[row_hash] = known_rows[row_hash]
+                    all_rides.append(known_rows[row_hash])
+                    continue
             data = {
                 'from': id_from,
                 'to': id_to,
             }
-            # Departure time
-            dep_time_str = ride.cssselect('div.col_depart')[0].text
-            dep_time_list = dep_time_str.split(':')
-            dep_dtime = datetime.datetime(input_data['departure'].year, input_data['departure'].month, input_data['departure'].day,
-                                          int(dep_time_list[0]), int(dep_time_list[1]))
-            data['departure'] = dep_dtime.strftime('%Y-%m-%d %H:%M')
-            # Arrival time
-            arr_time_str = ride.cssselect('div.col_arival')[0].text
-            dep_time_list = arr_time_str.split(':')
-            dep_dtime = datetime.datetime(input_data['departure'].year, input_data['departure'].month, input_data['departure'].day,
-                                          int(dep_time_list[0]), int(dep_time_list[1]))
-            data['arrival'] = dep_dtime.strftime('%Y-%m-%d %H:%M')
+            # Collect the columns in one pass over the row.
+            columns = {}
+            for div in ride.iter('div'):
+                for css_class in (div.get('class') or '').split():
+                    if css_class.startswith('col_') and css_class not in columns:
+                        columns[css_class] = div
+            # Departure and arrival time
+            data['departure'] = self._format_ride_time(date_prefix, columns['col_depart'].text)
+            data['arrival'] = self._format_ride_time(date_prefix, columns['col_arival'].text)
             # Type
-            img_type = ride.xpath('./div[@class="col_icon"]/a/img')[0].get('title')
-            if img_type == 'Autobus':
-                data['type'] = 'bus'
-            elif img_type == 'Vlak':
-                data['type'] = 'train'
-            elif img_type == 'Autobus / Vlak':
-                data['type'] = 'bus/train'
+            img_type = self._icon_xpath(ride)[0].get('title')
+            if img_type in self.ride_types:
+                data['type'] = self.ride_types[img_type]
             # Lowest price
-            price_str = ride.cssselect('div.col_price_no_basket_image')
-            if price_str:
-                price_str = price_str[0].text_content().strip()
-                price_numbers = re.findall('\d+', price_str)
-                data['price'] = float(price_numbers[0])
-            else:
-                price_str = ride.cssselect('div.col_price')[0].text_content()
-                data['price'] = float(re.findall('\d+', price_str)[0])
+            price_div = columns.get('col_price_no_basket_image')
+            if price_div is None:
+                price_div = columns['col_price']
+            data['price'] = float(self._number_re.search(price_div.text_content()).group())
             # City names
             data['from_name'] = input_data['from']
             data['to_name'] = input_data['to']
             # Seats
-            seats_str = ride.cssselect('div.col_space')[0].text
-            seats_num = int(re.findall('\d+', seats_str)[0])
-            data['seats'] = seats_num
-            # Book free seat?
-            if seats_num == book_free_seats:
-                print('Booking ticket! {0}'.format(str(data)))
-                return self.create_reservation(id_from, id_to, input_data['departure'], r_n)
+            data['seats'] = int(self._number_re.search(columns['col_space'].text).group())
             # Insert data
             all_rides.append(data)
+            if current_rows is not None:
+                current_rows[row_hash] = data
         # Result
         return all_rides
 
+    @staticmethod
+    def _format_ride_time(date_prefix, time_str):
+        hours, minutes = time_str.split(':')
+        return '{0} {1:02d}:{2:02d}'.format(date_prefix, int(hours), int(minutes))
+
 
     def create_reservation(self, id_from, id_to, departure_date, route_view_number):
         # REQ 1 - Add ticket
-        url = ('https://jizdenky.regiojet.cz/Booking/from/{0}/to/{1}/tarif/REGULAR/departure/{2}/retdep/{3}'
+        url = (self.booking_url + '/Booking/from/{0}/to/{1}/tarif/REGULAR/departure/{2}/retdep/{3}'
                '/return/false?1-1.IBehaviorListener.0-mainPanel-routesPanel-content-outwardpanel-routesList-panel~content-'
                'routesView-1-routeView-{4}-routeSummary-sidePanel&_=1474795086808'
                .format(id_from, id_to, departure_date.strftime(self.dtformat), departure_date.strftime(self.dtformat), route_view_number))
@@ -123,14 +205,14 @@ class StudentAgencyParser(object):
         self.g.cookies.set(name='ybus.czCookiePolicyAccepted', value='1', domain='jizdenky.regiojet.cz', path='/')
         self.g.load_cookies()
         # REQ 2 - Order whole basket
-        url = ('https://jizdenky.regiojet.cz/Booking/from/{0}/to/{1}/tarif/REGULAR/departure/{2}/retdep/{3}'
+        url = (self.booking_url + '/Booking/from/{0}/to/{1}/tarif/REGULAR/departure/{2}/retdep/{3}'
                '/return/false?1-1.ILinkListener-basketPanel-orderButton'
                .format(id_from, id_to, departure_date.strftime(self.dtformat), departure_date.strftime(self.dtformat)))
         self.g.go(url)
         #self.g.go(self.g.response.url)
         self.g.response.browse()
         # REQ 3 - Choose seat and agree to terms
-        url = ('https://jizdenky.regiojet.cz/Purchase?3-1.IFormSubmitListener-bookingWizard-wizardStepContent-mainForm')
+        url = (self.booking_url + '/Purchase?3-1.IFormSubmitListener-bookingWizard-wizardStepContent-mainForm')
         post_data = {
             'id1ac_hf_0': '',
             'bottomComponent:accountPhonePanel:stylablePanel:accountPhone:': '',
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Local stub of studentagency.cz / regiojet.cz which replays recorded responses from test_inputs/.
+Usage: python upstream_stub.py [--port 8090] [--latency 200] [--jitter 50] [--error-rate 0.01]
+
+Point the parser to the stub with configs/upstream.json:
+    {"home_url": "http://127.0.0.1:8090", "booking_url": "http://127.0.0.1:8090", "data_url": "http://127.0.0.1:8090"}
+Request counters are available at /_stats (JSON) and can be cleared by /_reset.
+"""
+import re
+import json
+import time
+import random
+import argparse
+import threading
+import os.path
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+# Filepaths
+current_dir = os.path.dirname(os.path.realpath(__file__))
+test_inputs_dir = os.path.abspath(current_dir + '/test_inputs')
+
+# Recorded responses
+RECORDED_DATE = '20161109'
+RESPONSES = {
+    'destinations': open(test_inputs_dir + '/destinations-cs.json').read(),
+    'booking': open(test_inputs_dir + '/booking_page.html').read(),
+    'routes': open(test_inputs_dir + '/routes_panel.html').read(),
+}
+booking_re = re.compile(r'^/Booking/from/\d+/to/\d+/tarif/\w+/departure/(\d{8})/')
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, jitter=0.0, error_rate=0.0):
+        HTTPServer.__init__(self, address, StubHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.stats_lock = threading.Lock()
+        self.stats = {}
+
+    def count(self, name):
+        with self.stats_lock:
+            self.stats[name] = self.stats.get(name, 0) + 1
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        # Control endpoints
+        if self.path == '/_stats':
+            with self.server.stats_lock:
+                return self._send(200, json.dumps(self.server.stats), 'application/json')
+        if self.path == '/_reset':
+            with self.server.stats_lock:
+                self.server.stats = {}
+            return self._send(200, '{}', 'application/json')
+        # Recorded pages
+        name, body, content_type = self._route()
+        self.server.count(name)
+        time.sleep(max(0.0, random.gauss(self.server.latency, self.server.jitter)))
+        if name != 'not_found' and random.random() < self.server.error_rate:
+            self.server.count('errors')
+            return self._send(503, 'Service Unavailable', 'text/plain')
+        self._send(200 if name != 'not_found' else 404, body, content_type)
+
+    def _route(self):
+        path = self.path.split('?')[0]
+        if path in ('', '/'):
+            return 'home', '<html><body>Student Agency</body></html>', 'text/html; charset=utf-8'
+        if path == '/data/wc/ybus-form/destinations-cs.json':
+            return 'destinations', RESPONSES['destinations'], 'application/json'
+        match = booking_re.match(path)
+        if match:
+            # The routes panel is fetched with a Wicket listener in the query string.
+            if 'routesPanel' in self.path:
+                return 'routes', RESPONSES['routes'].replace(RECORDED_DATE, match.group(1)), 'text/html; charset=utf-8'
+            return 'booking', RESPONSES['booking'], 'text/html; charset=utf-8'
+        return 'not_found', 'Not Found', 'text/plain'
+
+    def _send(self, code, body, content_type):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Stub of the rides upstream sites.')
+    arg_parser.add_argument('--host', default='127.0.0.1')
+    arg_parser.add_argument('--port', type=int, default=8090)
+    arg_parser.add_argument('--latency', type=float, default=0, help='Mean response latency (ms).')
+    arg_parser.add_argument('--jitter', type=float, default=0, help='Standard deviation of the latency (ms).')
+    arg_parser.add_argument('--error-rate', type=float, default=0, help='Share of requests answered with HTTP 503.')
+    args = arg_parser.parse_args()
+
+    server = StubServer((args.host, args.port), args.latency / 1000, args.jitter / 1000, args.error_rate)
+    print('Upstream stub listening on http://{0}:{1}'.format(args.host, args.port))
+    server.serve_forever()
@@ -1,10 +1,17 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import sys
+import gzip
 import unittest
 import os.path
 import datetime
+import subprocess
+from cStringIO import StringIO
 
 from src.CombinationsFinder import CombinationsFinder
+from src.ConnectionScanner import ConnectionScanner
+from src.SpillingPathSink import SpillingPathSink
+from src.SearchConstraints import SearchConstraints
 
 # Filepaths
 current_dir = os.path.dirname(os.path.realpath(__file__))
@@ -113,6 +120,49 @@ class TestCombinationsFinder(unittest.TestCase):
         # Compare it!
         self.assertTrue(set(manual_combinations) == set(program_combinations))
 
+    def test_generated_depths(self):
+        """
+        Check the graph analysis of the small dataset (acyclic graph, maximal depths of the nodes).
+        """
+        c_finder = CombinationsFinder()
+        with open(test_inputs_dir + '/small_data.csv') as test_file:
+            c_finder.read_input_and_get_combinations(test_file, True, 4)
+        self.assertTrue(c_finder.graph_is_acyclic)
+        self.assertEqual(c_finder.graph_depths['d3'], 3)
+        self.assertEqual(c_finder.graph_depths['u2'], 2)
+        self.assertEqual(c_finder.graph_depths['h2'], 1)
+
+    def test_count_combinations_upper_bound(self):
+        """
+        In the small dataset, the estimated count is the same as the number of found combinations.
+        In the task datasets, it is an upper bound (the segment rule is not applied), exact for two flights.
+        """
+        c_finder = CombinationsFinder()
+        with open(test_inputs_dir + '/small_data.csv') as test_file:
+            combinations = c_finder.read_input_and_get_combinations(test_file, True, 4)
+        self.assertEqual(c_finder.count_flight_combinations_upper_bound(), len(combinations))
+        self.assertEqual(c_finder.count_flight_combinations_upper_bound(2), 4)
+        for file_name, upper_bound, found_count in [('task_data.csv', 79, 33), ('task_data_half.csv', 52, 18)]:
+            c_finder = CombinationsFinder()
+            with open(test_inputs_dir + '/' + file_name) as test_file:
+                combinations = c_finder.read_input_and_get_combinations(test_file, True, 4)
+            self.assertEqual(len(combinations), found_count)
+            self.assertEqual(c_finder.count_flight_combinations_upper_bound(), upper_bound)
+            self.assertEqual(c_finder.count_flight_combinations_upper_bound(2),
+                             len([path for path in combinations if len(path) == 2]))
+
+    def test_combinations_from_flights(self):
+        """
+        Combinations found flight by flight are the same as all combinations (in the same order).
+        """
+        c_finder = CombinationsFinder()
+        with open(test_inputs_dir + '/task_data.csv') as test_file:
+            combinations = list(c_finder.read_input_and_get_combinations(test_file, True, 4))
+        combinations_from = [path for flight_id in c_finder.graph_nodes
+                             for path in c_finder.find_flight_combinations_from(flight_id)]
+        self.assertEqual(combinations_from, combinations)
+        self.assertEqual(c_finder.all_paths, combinations)
+
     # Test validity of combinations found in the datasets.
 
     def test_if_found_combinations_are_valid_1(self):
@@ -227,6 +277,326 @@ class TestCombinationsFinder(unittest.TestCase):
         return True
 
 
+class TestConnectionScanner(unittest.TestCase):
+    """
+    Check the journeys found by the connection scan engine in the small dataset against manually found ones.
+    """
+
+    def setUp(self):
+        c_finder = CombinationsFinder()
+        with open(test_inputs_dir + '/small_data.csv') as test_file:
+            c_finder.read_input(test_file)
+        self.scanner = ConnectionScanner(c_finder, 4)
+
+    def test_earliest_arrival_direct(self):
+        """
+        A direct flight is the earliest arrival.
+        """
+        self.assertEqual(self.scanner.earliest_arrival('DPS', 'HKT'), ['d2'])
+
+    def test_earliest_arrival_start_time(self):
+        """
+        After the direct flight departed, a journey with a stopover is found.
+        """
+        self.assertEqual(self.scanner.earliest_arrival('DPS', 'HKT', '2016-10-11T06:00:00'), ['d3', 'u2'])
+
+    def test_earliest_arrival_unreachable(self):
+        """
+        If the destination cannot be reached (b1 lands after d3 takes off), None is returned.
+        """
+        self.assertIsNone(self.scanner.earliest_arrival('BWN', 'HKT'))
+
+    def test_latest_departure(self):
+        """
+        The latest departure may need a stopover.
+        """
+        self.assertEqual(self.scanner.latest_departure('USM', 'BWN'), ['u2', 'h2'])
+        self.assertEqual(self.scanner.latest_departure('DPS', 'HKT', '2016-10-11T20:00:00'), ['d2'])
+
+    def test_profile(self):
+        """
+        Only Pareto-optimal journeys (by arrival time and number of flights) are returned.
+        """
+        self.assertEqual(self.scanner.profile('DPS', 'BWN'), [['d1']])
+        self.assertEqual(self.scanner.profile('DPS', 'BWN', '2016-10-11T06:00:00'), [['d3', 'u2', 'h2']])
+
+    def test_earliest_arrival_same_as_combinations(self):
+        """
+        In the task dataset, the earliest arrival is the same as the earliest one among direct flights and combinations.
+        """
+        c_finder = CombinationsFinder()
+        with open(test_inputs_dir + '/task_data.csv') as test_file:
+            combinations = c_finder.read_input_and_get_combinations(test_file, True, 4)
+        scanner = ConnectionScanner(c_finder, 4)
+        journeys = combinations + [[flight_id] for flight_id in c_finder.flight_database]
+        for source in c_finder.airport_flights:
+            for destination in c_finder.airport_flights:
+                arrivals = [c_finder.flight_database[j[-1]]['arrival_time'] for j in journeys
+                            if c_finder.flight_database[j[0]]['source'] == source and
+                            c_finder.flight_database[j[-1]]['destination'] == destination]
+                journey = scanner.earliest_arrival(source, destination)
+                if arrivals:
+                    self.assertEqual(c_finder.flight_database[journey[-1]]['arrival_time'], min(arrivals))
+                else:
+                    self.assertIsNone(journey)
+
+
+class TestSpillingPathSink(unittest.TestCase):
+    """
+    Check that paths stored in the sink (also when spilled to temporary files) are the same as in the list.
+    """
+
+    def setUp(self):
+        self.c_finder = CombinationsFinder()
+        with open(test_inputs_dir + '/task_data.csv') as test_file:
+            self.combinations = list(self.c_finder.read_input_and_get_combinations(test_file, True, 4))
+
+    def _find_to_sink(self, **sink_args):
+        sink = SpillingPathSink(self.c_finder, 10, **sink_args)
+        self.c_finder.find_flight_combinations(10, result_sink=sink)
+        return sink
+
+    def test_same_order_in_memory(self):
+        """
+        Without sorting and spilling, the paths are in the order in which they were found.
+        """
+        with self._find_to_sink() as sink:
+            self.assertEqual(list(sink), self.combinations)
+            self.assertEqual(len(sink), len(self.combinations))
+
+    def test_same_order_spilled(self):
+        """
+        With a tiny memory budget, the paths are spilled to more runs and merged back in the same order.
+        """
+        with self._find_to_sink(memory_budget_mb=0.001) as sink:
+            self.assertTrue(len(sink.runs) > 1)
+            self.assertEqual(list(sink), self.combinations)
+            run_files = list(sink.runs)
+        # Temporary files are deleted.
+        self.assertFalse([f for f in run_files if os.path.exists(f)])
+
+    def test_merge_passes(self):
+        """
+        With more runs than MAX_MERGE_RUNS, the runs are merged in more passes and the order is the same.
+        """
+        for sort_by in SpillingPathSink.SORT_KEYS:
+            with self._find_to_sink(sort_by=sort_by) as sink:
+                paths = list(sink)
+            with self._find_to_sink(memory_budget_mb=0.0002, sort_by=sort_by) as sink:
+                sink.MAX_MERGE_RUNS = 2
+                self.assertTrue(len(sink.runs) > 4)
+                self.assertEqual(list(sink), paths)
+                self.assertTrue(len(sink.runs) <= 2)
+                run_files = list(sink.runs)
+            self.assertFalse([f for f in run_files if os.path.exists(f)])
+
+    def test_large_keys(self):
+        """
+        Sort keys over 32 bits (i.e. more than 2**31 paths without sorting) fit in the records.
+        """
+        with SpillingPathSink(self.c_finder, 10, memory_budget_mb=0.001) as sink:
+            sink.count = 2 ** 32
+            for path in self.combinations:
+                sink.append(path)
+            # list(sink) would allocate a list for all 2**32 counted paths.
+            self.assertEqual([path for path in iter(sink)], self.combinations)
+
+    def test_sorted_by_total_duration(self):
+        """
+        Spilled paths are merged sorted by the total duration.
+        """
+        def total_duration(path):
+            return self._parse_time(path[-1], 'arrival_time') - self._parse_time(path[0], 'departure_time')
+        with self._find_to_sink(memory_budget_mb=0.001, sort_by='total_duration') as sink:
+            paths = list(sink)
+        self.assertEqual(sorted(paths), sorted(self.combinations))
+        durations = [total_duration(path) for path in paths]
+        self.assertEqual(durations, sorted(durations))
+
+    def test_sorted_by_start_time(self):
+        """
+        Spilled paths are merged sorted by the departure of the first flight.
+        """
+        with self._find_to_sink(memory_budget_mb=0.001, sort_by='start_time') as sink:
+            paths = list(sink)
+        self.assertEqual(sorted(paths), sorted(self.combinations))
+        departures = [self._parse_time(path[0], 'departure_time') for path in paths]
+        self.assertEqual(departures, sorted(departures))
+
+    def test_memory_budget(self):
+        """
+        Peak memory of 300 000 sorted paths stays within the memory budget (8 MB).
+        It is measured in a new process, peak memory of this one depends on the other tests.
+        """
+        code = (
+            'import resource\n'
+            'from src.CombinationsFinder import CombinationsFinder\n'
+            'from src.SpillingPathSink import SpillingPathSink\n'
+            'c_finder = CombinationsFinder()\n'
+            'c_finder.read_input(open("test_inputs/task_data.csv"))\n'
+            'flights = sorted(c_finder.flight_database)\n'
+            'start_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss\n'
+            'sink = SpillingPathSink(c_finder, 10, memory_budget_mb=8, sort_by="total_duration")\n'
+            'for i in xrange(300000):\n'
+            '    sink.append([flights[i % 31], flights[i % 29], flights[i % 23], flights[i % 19]])\n'
+            'assert sum(1 for path in sink) == 300000\n'
+            'sink.close()\n'
+            'print((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start_memory) / 1024.0)\n'
+        )
+        memory_mb = float(subprocess.check_output([sys.executable, '-c', code], cwd=current_dir))
+        self.assertTrue(memory_mb < 8, 'Paths took %.1f MB.' % memory_mb)
+
+    def test_sink_not_kept(self):
+        """
+        After the search with a sink, the finder stores paths to its list again.
+        """
+        with self._find_to_sink() as sink:
+            self.assertEqual(self.c_finder.all_paths, self.combinations)
+        self.c_finder.all_paths = []
+        self.assertEqual(self.c_finder.find_flight_combinations(10), self.combinations)
+        self.assertEqual(len(sink), 0)
+
+    def test_wrong_sort_key(self):
+        with self.assertRaises(ValueError):
+            SpillingPathSink(self.c_finder, 10, sort_by='price')
+
+    def _parse_time(self, flight_id, field):
+        return datetime.datetime.strptime(self.c_finder.flight_database[flight_id][field], '%Y-%m-%dT%H:%M:%S')
+
+
+class TestSearchConstraints(unittest.TestCase):
+    """
+    Check the combinations found with constraints in the small dataset against manually found ones
+    and in the task dataset against filtered combinations found without constraints.
+    """
+
+    def _find_small(self, **constraints_args):
+        c_finder = CombinationsFinder()
+        with open(test_inputs_dir + '/small_data.csv') as test_file:
+            c_finder.read_input(test_file)
+        c_finder.generate_possible_connections(4)
+        combinations = c_finder.find_flight_combinations(constraints=SearchConstraints(**constraints_args))
+        return set(tuple(path) for path in combinations)
+
+    def test_origins(self):
+        self.assertEqual(self._find_small(origins=['DPS']), {('d3', 'u2'), ('d3', 'u2', 'h2'), ('d3', 'u2', 'h3')})
+
+    def test_destinations(self):
+        self.assertEqual(self._find_small(destinations=['BWN']), {('u2', 'h2'), ('d3', 'u2', 'h2')})
+
+    def test_max_duration(self):
+        self.assertEqual(self._find_small(max_duration_hours=3), {('u2', 'h2')})
+
+    def test_start_and_end_times(self):
+        self.assertEqual(self._find_small(earliest_start='2016-10-11T06:00:00', latest_end='2016-10-11T23:59:00'),
+                         {('u2', 'h2'), ('d3', 'u2'), ('d3', 'u2', 'h2')})
+        self.assertEqual(self._find_small(latest_start='2016-10-11T06:00:00'), {('h1', 'u1')})
+
+    def test_excluded_airports(self):
+        self.assertEqual(self._find_small(excluded_airports=['BWN']),
+                         {('h1', 'u1'), ('u2', 'h3'), ('d3', 'u2'), ('d3', 'u2', 'h3')})
+        self.assertEqual(self._find_small(excluded_airports=['USM']), set())
+
+    def test_wrong_time_format(self):
+        with self.assertRaises(ValueError):
+            SearchConstraints(latest_end='2016-10-11 23:59')
+
+    def test_same_as_filtered(self):
+        """
+        In the task dataset, the search with constraints finds the same combinations (in the same order)
+        as filtering of all combinations.
+        """
+        c_finder = CombinationsFinder()
+        with open(test_inputs_dir + '/task_data.csv') as test_file:
+            combinations = list(c_finder.read_input_and_get_combinations(test_file, True, 4))
+        for constraints_args in [{'origins': ['DPS', 'USM']}, {'destinations': ['USM']}, {'max_duration_hours': 8},
+                                 {'latest_end': '2016-10-11T18:00:00', 'excluded_airports': ['HKT']}]:
+            constraints = SearchConstraints(**constraints_args)
+            c_finder.all_paths = []
+            constrained_combinations = list(c_finder.find_flight_combinations(constraints=constraints))
+            self.assertEqual(constrained_combinations, [p for p in combinations if constraints.is_path_accepted(p)])
+
+
+class TestCommandLine(unittest.TestCase):
+    """
+    Run find_combinations.py as a process. Its output must be the same as the output of the original script
+    (all combinations formatted at once and printed), also with more workers and with compressed input and output.
+    """
+
+    def _run(self, args, input_data=None):
+        """
+        Run the script with the arguments. Returns (exit code, stdout, stderr).
+        """
+        process = subprocess.Popen([sys.executable, 'find_combinations.py'] + args, cwd=current_dir,
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output, errors = process.communicate(input_data)
+        return process.returncode, output, errors
+
+    def _original_output(self, file_name, output_format='csv'):
+        c_finder = CombinationsFinder()
+        with open(test_inputs_dir + '/' + file_name) as test_file:
+            combinations = c_finder.read_input_and_get_combinations(test_file, True, 4)
+        if output_format == 'json':
+            return c_finder.process_and_format_found_combinations_to_json(combinations) + '\n'
+        return c_finder.process_and_format_found_combinations_to_csv(combinations) + '\n'
+
+    def _read_test_input(self, file_name):
+        with open(test_inputs_dir + '/' + file_name, 'rb') as test_file:
+            return test_file.read()
+
+    @staticmethod
+    def _gzip(data):
+        gzip_buffer = StringIO()
+        with gzip.GzipFile(fileobj=gzip_buffer, mode='wb') as gzip_file:
+            gzip_file.write(data)
+        return gzip_buffer.getvalue()
+
+    @staticmethod
+    def _gunzip(data):
+        return gzip.GzipFile(fileobj=StringIO(data)).read()
+
+    def test_same_as_original(self):
+        for file_name in ('small_data.csv', 'task_data.csv', 'task_data_half.csv'):
+            for output_format in ('csv', 'json'):
+                exit_code, output, _ = self._run(['--format', output_format], self._read_test_input(file_name))
+                self.assertEqual(exit_code, 0)
+                self.assertEqual(output, self._original_output(file_name, output_format))
+
+    def test_workers(self):
+        exit_code, output, _ = self._run(['-i', 'test_inputs/task_data.csv', '--workers', '3'])
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(output, self._original_output('task_data.csv'))
+
+    def test_gzip_stdin_stdout(self):
+        """
+        gzip input is read from a pipe and the output is compressed separately (also from plain input).
+        """
+        plain_input = self._read_test_input('task_data.csv')
+        exit_code, output, _ = self._run(['--input-compression', 'gzip', '--output-compression', 'gzip'],
+                                         self._gzip(plain_input))
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(self._gunzip(output), self._original_output('task_data.csv'))
+        # Concatenated gzip members (i.e. appended files)
+        exit_code, output, _ = self._run(['--input-compression', 'gzip'],
+                                         self._gzip(plain_input[:700]) + self._gzip(plain_input[700:]))
+        self.assertEqual(output, self._original_output('task_data.csv'))
+        exit_code, output, _ = self._run(['-i', 'test_inputs/task_data.csv', '--output-compression', 'gzip'])
+        self.assertEqual(self._gunzip(output), self._original_output('task_data.csv'))
+
+    def test_input_errors(self):
+        """
+        Wrong input data and unreadable input end with a message (exit code 1).
+        """
+        exit_code, _, errors = self._run(['-i', 'test_inputs/read_test_blank_field.csv'])
+        self.assertEqual((exit_code, errors.strip()), (1, 'There is a blank field on line 3.'))
+        exit_code, _, errors = self._run(['-i', 'test_inputs/task_data.csv', '--input-compression', 'gzip'])
+        self.assertEqual(exit_code, 1)
+        self.assertTrue(errors.startswith('Cannot read the input'))
+        exit_code, _, errors = self._run(['-i', 'test_inputs/missing.csv'])
+        self.assertEqual(exit_code, 1)
+        self.assertTrue(errors.startswith('Cannot read the input'))
+
+
 # Run all tests when the file is run from terminal.
 if __name__ == '__main__':
     unittest.main()
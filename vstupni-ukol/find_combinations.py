@@ -1,37 +1,283 @@
 #!/usr/bin/env python
 # -*- coding: UTF-8 -*-
+"""
+Find all combinations of subsequent flights.
 
+Usage: cat input.csv | python find_combinations.py
+       python find_combinations.py -i flights.csv.gz -o combinations.json.zst --format json --workers 4 --stats
+       cat flights.csv.gz | python find_combinations.py --input-compression gzip --output-compression gzip
+Run with --help to see all parameters.
+"""
+import io
 import sys
+import gzip
+import time
+import zlib
+import argparse
+import resource
+import multiprocessing
+from functools import partial
 
 from src.CombinationsFinder import CombinationsFinder
+from src.SpillingPathSink import SpillingPathSink
+from src.SearchConstraints import SearchConstraints
 
-# Parameters
+# Default parameters
 MAX_STOPOVER_HOURS = 4
 MIN_STOPOVER_HOURS = 1
 MAX_FLIGHTS_COUNT = 10
 FORBID_BACKLINKS = False
 OUTPUT_FORMAT = 'csv'
 
-# Create the main object.
+# The main object and search constraints. Worker processes get them (with the graph) by forking.
 comb_finder = CombinationsFinder()
+search_constraints = None
 
-# 1. Read flight data from standard input.
-# Format: source,destination,departure,arrival,flight_number
-try:
-    comb_finder.read_input(sys.stdin)
-except Exception, e:
-    sys.exit(e[0])
-
-# 2. Find subsequent flights.
-comb_finder.generate_possible_connections(MAX_STOPOVER_HOURS, MIN_STOPOVER_HOURS)
-
-# 3. Find all flight combinations.
-all_combinations = comb_finder.find_flight_combinations(MAX_FLIGHTS_COUNT, FORBID_BACKLINKS)
-
-# 4. Show the result.
-if OUTPUT_FORMAT == 'csv':
-    print(comb_finder.process_and_format_found_combinations_to_csv(all_combinations))
-elif OUTPUT_FORMAT == 'json':
-    print(comb_finder.process_and_format_found_combinations_to_json(all_combinations))
-else:
-    sys.exit('Please specify a supported output format.')
+
+def parse_args():
+    arg_parser = argparse.ArgumentParser(description='Find all combinations of subsequent flights.')
+    arg_parser.add_argument('-i', '--input', default='-',
+                            help='Input CSV file (source,destination,departure,arrival,flight_number). Default: stdin.')
+    arg_parser.add_argument('-o', '--output', default='-', help='Output file. Default: stdout.')
+    arg_parser.add_argument('--input-compression', choices=['auto', 'none', 'gzip', 'zstd'], default='auto',
+                            help='Compression of the input (auto = by extension .gz or .zst, none for stdin).')
+    arg_parser.add_argument('--output-compression', choices=['auto', 'none', 'gzip', 'zstd'], default='auto',
+                            help='Compression of the output (auto = by extension .gz or .zst, none for stdout).')
+    arg_parser.add_argument('--no-header', action='store_true', help='The input has no header line.')
+    arg_parser.add_argument('--max-stopover', type=int, default=MAX_STOPOVER_HOURS,
+                            help='Maximal waiting time between two subsequent flights (hours).')
+    arg_parser.add_argument('--min-stopover', type=int, default=MIN_STOPOVER_HOURS,
+                            help='Minimal waiting time between two subsequent flights (hours).')
+    arg_parser.add_argument('--max-flights', type=int, default=MAX_FLIGHTS_COUNT,
+                            help='Maximal number of flights during the whole trip.')
+    arg_parser.add_argument('--forbid-backlinks', action='store_true', default=FORBID_BACKLINKS,
+                            help='Once visited airport cannot be visited again (except for return trips).')
+    arg_parser.add_argument('--origins', help='Comma-separated codes of airports where the trips may start.')
+    arg_parser.add_argument('--destinations', help='Comma-separated codes of airports where the trips may end.')
+    arg_parser.add_argument('--exclude', help='Comma-separated codes of airports which must not be visited.')
+    arg_parser.add_argument('--max-duration', type=float, help='Maximal total duration of the trip (hours).')
+    arg_parser.add_argument('--earliest-start', help='The first flight must not depart earlier (YYYY-MM-DDTHH:MM:SS).')
+    arg_parser.add_argument('--latest-start', help='The first flight must not depart later.')
+    arg_parser.add_argument('--latest-end', help='The last flight must not arrive later.')
+    arg_parser.add_argument('--format', choices=['csv', 'json'], default=OUTPUT_FORMAT, help='Output format.')
+    arg_parser.add_argument('--sort', choices=['start_time', 'total_duration'],
+                            help='Sort the combinations (they are spilled to temporary files if needed).')
+    arg_parser.add_argument('--memory-budget', type=float, default=64,
+                            help='Memory for sorted combinations before they are spilled to disk (MB).')
+    arg_parser.add_argument('--workers', type=int, default=1, help='Number of processes searching for combinations.')
+    arg_parser.add_argument('--stats', action='store_true', help='Print time and memory of every phase to stderr.')
+    return arg_parser.parse_args()
+
+
+def open_file(path, mode, compression):
+    """
+    Open a (compressed) input or output file. Path '-' means standard input/output.
+    Compression 'auto' is chosen by the file extension (.gz = gzip, .zst = zstd).
+    gzip input is decompressed as a stream (GzipFile seeks, so it cannot read a pipe).
+    zstd needs the zstandard module (pip install zstandard).
+    """
+    if compression == 'auto':
+        compression = 'gzip' if path.endswith('.gz') else 'zstd' if path.endswith('.zst') else 'none'
+    if path == '-':
+        raw_file = sys.stdin if mode == 'rb' else sys.stdout
+    else:
+        raw_file = open(path, mode)
+    if compression == 'gzip':
+        if mode == 'rb':
+            return io.BufferedReader(GzipStreamReader(raw_file))
+        return gzip.GzipFile(fileobj=raw_file, mode=mode)
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            sys.exit('Please install the zstandard module for zstd compression.')
+        if mode == 'rb':
+            return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw_file))
+        return zstandard.ZstdCompressor().stream_writer(raw_file)
+    return raw_file
+
+
+class GzipStreamReader(io.RawIOBase):
+    """
+    Decompress a gzip stream as it is read (also concatenated gzip members).
+    """
+
+    CHUNK_SIZE = 65536
+
+    def __init__(self, raw_file):
+        self.raw_file = raw_file
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.pending = ''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.pending:
+            chunk = self.raw_file.read(self.CHUNK_SIZE)
+            if not chunk:
+                self.pending = self.decompressor.flush()
+                if not self.pending:
+                    return 0
+                break
+            self.pending = self.decompressor.decompress(chunk)
+            # The next gzip member starts in the unused data.
+            while self.decompressor.unused_data:
+                chunk = self.decompressor.unused_data
+                self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                self.pending += self.decompressor.decompress(chunk)
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+
+def find_paths_from(flight_id, max_flights_count, forbid_backlinks):
+    """
+    Find combinations starting with the flight (called in worker processes).
+    """
+    return comb_finder.find_flight_combinations_from(flight_id, max_flights_count, forbid_backlinks, search_constraints)
+
+
+def iter_paths(args):
+    """
+    Find all combinations. The flights are searched one by one (by more processes if set)
+    and their combinations are yielded in the same order as from find_flight_combinations().
+    """
+    find_paths = partial(find_paths_from, max_flights_count=args.max_flights, forbid_backlinks=args.forbid_backlinks)
+    if args.workers > 1:
+        pool = multiprocessing.Pool(args.workers)
+        results = pool.imap(find_paths, list(comb_finder.graph_nodes), chunksize=16)
+    else:
+        pool = None
+        results = (find_paths(flight_id) for flight_id in comb_finder.graph_nodes)
+    for paths in results:
+        for path in paths:
+            yield path
+    if pool:
+        pool.close()
+        pool.join()
+
+
+class Stats(object):
+    """
+    Time and peak memory of the phases (peak memory of the workers is included).
+    """
+
+    def __init__(self):
+        self.phases = []
+        self.phase_start = time.time()
+
+    def end_phase(self, name):
+        now = time.time()
+        memory_kb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        self.phases.append((name, now - self.phase_start, memory_kb / 1024.0))
+        self.phase_start = now
+
+    def report(self, counts):
+        lines = ['%-20s %10s %18s' % ('phase', 'time (s)', 'peak memory (MB)')]
+        for name, duration, memory_mb in self.phases:
+            lines.append('%-20s %10.3f %18.1f' % (name, duration, memory_mb))
+        lines.append('%-20s %10.3f' % ('total', sum(p[1] for p in self.phases)))
+        lines.append(', '.join('%s: %d' % count for count in counts))
+        return '\n'.join(lines)
+
+
+class CountedIterator(object):
+    """
+    Pass items through and count them.
+    """
+
+    def __init__(self, iterable):
+        self.iterable = iterable
+        self.count = 0
+
+    def __iter__(self):
+        for item in self.iterable:
+            self.count += 1
+            yield item
+
+
+def get_constraints(args):
+    """
+    Create search constraints from the arguments (None if there are none).
+    """
+    constraints_args = {
+        'origins': args.origins.split(',') if args.origins else None,
+        'destinations': args.destinations.split(',') if args.destinations else None,
+        'excluded_airports': args.exclude.split(',') if args.exclude else None,
+        'max_duration_hours': args.max_duration,
+        'earliest_start': args.earliest_start,
+        'latest_start': args.latest_start,
+        'latest_end': args.latest_end,
+    }
+    if all(value is None for value in constraints_args.values()):
+        return None
+    try:
+        return SearchConstraints(**constraints_args)
+    except ValueError:
+        sys.exit('Times must be in YYYY-MM-DDTHH:MM:SS format.')
+
+
+def main():
+    global search_constraints
+    args = parse_args()
+    stats = Stats()
+    search_constraints = get_constraints(args)
+
+    # 1. Read flight data.
+    # Format: source,destination,departure,arrival,flight_number
+    try:
+        input_file = open_file(args.input, 'rb', args.input_compression)
+        comb_finder.read_input(input_file, not args.no_header)
+    except (ValueError, IndexError), e:
+        sys.exit(e[0])  # Wrong input data (the message)
+    except (EnvironmentError, zlib.error), e:
+        sys.exit('Cannot read the input: %s' % e)
+    stats.end_phase('read input')
+
+    # 2. Find subsequent flights.
+    comb_finder.generate_possible_connections(args.max_stopover, args.min_stopover)
+    if search_constraints:
+        search_constraints.prepare(comb_finder)
+    stats.end_phase('connections')
+
+    # 3. Find all flight combinations. Unless they should be sorted, they are written right away.
+    all_combinations = iter_paths(args)
+    sink = None
+    if args.sort:
+        sink = SpillingPathSink(comb_finder, args.max_flights, args.memory_budget, args.sort)
+        for path in all_combinations:
+            sink.append(path)
+        all_combinations = sink
+        stats.end_phase('combinations')
+
+    # 4. Write the result.
+    output_file = open_file(args.output, 'wb', args.output_compression)
+    counted_combinations = CountedIterator(all_combinations)
+    if args.format == 'csv':
+        output_parts = comb_finder.iter_found_combinations_as_csv(counted_combinations)
+    else:
+        output_parts = comb_finder.iter_found_combinations_as_json(counted_combinations)
+    for part in output_parts:
+        output_file.write(part)
+    output_file.write('\n')  # The end of the output is the same as from print in the original script.
+    if output_file is sys.stdout:
+        output_file.flush()
+    else:
+        output_file.close()
+    if sink:
+        sink.close()
+    stats.end_phase('output' if args.sort else 'combinations+output')
+
+    if args.stats:
+        sys.stderr.write(stats.report([
+            ('flights', len(comb_finder.graph_nodes)),
+            ('connections', len(comb_finder.graph_edges)),
+            ('combinations', counted_combinations.count),
+        ]) + '\n')
+
+
+if __name__ == '__main__':
+    main()
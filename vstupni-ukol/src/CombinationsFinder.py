@@ -11,7 +11,7 @@ class CombinationsFinder(object):
     b) Call the methods one by one, in the following order:
     1. read_input()
     2. generate_possible_connections()
-    3. find_flight_combinations()
+    3. find_flight_combinations() (or count_flight_combinations_upper_bound() to estimate their number)
     At the end, to show the results, you must call process_and_format_found_paths_to_json or csv.
     """
 
@@ -23,6 +23,9 @@ class CombinationsFinder(object):
         self.airport_flights = {}  # Flights from given airport. 'airport_code' => ['fl1', 'fl4', ...]
         self.graph_nodes = {}      # Flights. 'flight_number' => None
         self.graph_edges = {}      # Possible connections of flights. ('flight_1', 'flight_2) => None
+        self.graph_children = {}   # Subsequent flights (children of the node). 'flight_number' => ['fl2', 'fl5', ...]
+        self.graph_depths = {}     # Maximal number of flights in a path starting with the flight. 'flight_number' => 3
+        self.graph_is_acyclic = False  # True if a flight cannot be reached from itself (always for positive stopover).
         self.all_paths = []        # Found paths in the graph. [['fl1', 'fl2'], ['fl4', 'fl7', 'fl2']]
 
 
@@ -101,9 +104,11 @@ class CombinationsFinder(object):
                     # Add a valid connection to the graph.
                     #print next_flight_id
                     self.graph_edges[(flight_id, next_flight_id)] = None
-        # OK
+        # Prepare structures for the search.
+        self._analyze_graph()
 
-    def find_flight_combinations(self, max_flights_count=10, forbid_backlinks=False):
+    def find_flight_combinations(self, max_flights_count=10, forbid_backlinks=False, result_sink=None,
+                                 constraints=None):
         """
         For every flight, find all paths to other flights in the graph (path = combination of flights).
 
@@ -111,16 +116,87 @@ class CombinationsFinder(object):
             max_flights_count (int, optional): Maximal number of flights during the whole trip.
             forbid_backlinks (bool, optional): If true, once visited airport cannot be visited again.
                 Except if the trip starts and ends in the same airport ("return trip").
+            result_sink (object, optional): Storage for the found paths instead of a list (all_paths).
+                It must have an append(path) method and iterate over the paths, i.e. SpillingPathSink.
+                It is used only during this search, all_paths is not changed.
+            constraints (SearchConstraints, optional): Conditions of the combinations (i.e. origins, maximal duration),
+                checked during the search.
 
         Returns:
-            List of all found flight combinations. I.e. [['fl1', 'fl2'], ['fl4', 'fl7', 'fl2']]
+            All found flight combinations (the list or result_sink). I.e. [['fl1', 'fl2'], ['fl4', 'fl7', 'fl2']]
         """
-        for flight_id_from in self.graph_nodes:
-            #print("===Finding path from flight %s==") % flight_id_from
-            init_path = [flight_id_from]
-            self._find_all_paths_recursively(init_path, max_flights_count, forbid_backlinks)
+        all_paths = self.all_paths
+        if result_sink is not None:
+            self.all_paths = result_sink
+        if constraints is not None:
+            constraints.prepare(self)
+        try:
+            for flight_id_from in self.graph_nodes:
+                # Flights without subsequent flights do not start any combination.
+                if not self.graph_children.get(flight_id_from):
+                    continue
+                if constraints is not None and not constraints.is_start_allowed(flight_id_from):
+                    continue
+                #print("===Finding path from flight %s==") % flight_id_from
+                init_path = [flight_id_from]
+                self._find_all_paths_recursively(init_path, max_flights_count, forbid_backlinks, constraints)
+            # Result
+            return self.all_paths
+        finally:
+            if result_sink is not None:
+                self.all_paths = all_paths
+
+    def find_flight_combinations_from(self, flight_id_from, max_flights_count=10, forbid_backlinks=False,
+                                      constraints=None):
+        """
+        Find all paths starting with the given flight. It is one step of find_flight_combinations(),
+        so the flights can be searched independently (i.e. by more processes).
+
+        Args:
+            flight_id_from (str): Flight number of the first flight.
+            For other parameters description please see find_flight_combinations().
+
+        Returns:
+            List of found flight combinations starting with the flight.
+        """
+        if constraints is not None:
+            constraints.prepare(self)
+            if not constraints.is_start_allowed(flight_id_from):
+                return []
+        all_paths, self.all_paths = self.all_paths, []
+        try:
+            if self.graph_children.get(flight_id_from):
+                self._find_all_paths_recursively([flight_id_from], max_flights_count, forbid_backlinks, constraints)
+            return self.all_paths
+        finally:
+            self.all_paths = all_paths
+
+    def count_flight_combinations_upper_bound(self, max_flights_count=10):
+        """
+        Estimate the number of flight combinations by dynamic programming, without enumerating them
+        (i.e. to estimate size of a job). All paths of 2 to max_flights_count flights in the graph are counted.
+        Rules which depend on the whole path (repeated segments, backlinks) are not applied, so the result is
+        an upper bound of the number of combinations found by find_flight_combinations(). It is exact for
+        combinations of two flights and for graphs where no segment can repeat (i.e. small_data.csv).
+
+        Args:
+            max_flights_count (int, optional): Maximal number of flights during the whole trip.
+
+        Returns:
+            Upper bound of the number of combinations (int).
+        """
+        # Longer paths than the deepest one do not exist.
+        if self.graph_is_acyclic and self.graph_depths:
+            max_flights_count = min(max_flights_count, max(self.graph_depths.values()))
+        # Number of paths of the current length starting with the flight. 'flight_number' => count
+        paths_count = dict((flight_id, 1) for flight_id in self.graph_nodes)
+        total_count = 0
+        for _ in range(1, max_flights_count):
+            paths_count = dict((flight_id, sum(paths_count[child] for child in self.graph_children.get(flight_id, [])))
+                               for flight_id in self.graph_nodes)
+            total_count += sum(paths_count.values())
         # Result
-        return self.all_paths
+        return total_count
 
     def read_input_and_get_combinations(self, input_data_iterator, has_header, max_stopover_hours,
                                         min_stopover_hours=1, max_flights_count=10, forbid_backlinks=False):
@@ -135,6 +211,32 @@ class CombinationsFinder(object):
 
     #### PRIVATE METHODS
 
+    def _analyze_graph(self):
+        """
+        Prepare the graph for searching:
+            1. Create lists of children of all nodes from the edges (in the same order as the edges).
+            2. Sort the nodes topologically (Kahn's algorithm). If all nodes can be sorted, the graph is acyclic.
+            3. For acyclic graph, compute the maximal depth of every node (in reverse topological order).
+        """
+        self.graph_children = dict((flight_id, []) for flight_id in self.graph_nodes)
+        parents_count = dict((flight_id, 0) for flight_id in self.graph_nodes)
+        for (flight_1, flight_2) in self.graph_edges:
+            self.graph_children[flight_1].append(flight_2)
+            parents_count[flight_2] += 1
+        # Topological sort - the list is extended while iterating.
+        nodes_order = [flight_id for flight_id in self.graph_nodes if parents_count[flight_id] == 0]
+        for flight_id in nodes_order:
+            for child in self.graph_children[flight_id]:
+                parents_count[child] -= 1
+                if parents_count[child] == 0:
+                    nodes_order.append(child)
+        self.graph_is_acyclic = len(nodes_order) == len(self.graph_nodes)
+        # Depths
+        self.graph_depths = {}
+        if self.graph_is_acyclic:
+            for flight_id in reversed(nodes_order):
+                self.graph_depths[flight_id] = 1 + max([self.graph_depths[child] for child in self.graph_children[flight_id]] or [0])
+
     def _get_children(self, examined_node):
         """
         Find all subsequent flights for the examined flight. (Find all children of the examined node in the graph.)
@@ -145,9 +247,9 @@ class CombinationsFinder(object):
         Returns:
             List of possible flights (flight number as string).
         """
-        return [flight_2 for (flight_1, flight_2) in self.graph_edges.keys() if flight_1 == examined_node]
+        return self.graph_children.get(examined_node, [])
 
-    def _find_all_paths_recursively(self, current_path, max_flights_count=10, forbid_backlinks=False):
+    def _find_all_paths_recursively(self, current_path, max_flights_count=10, forbid_backlinks=False, constraints=None):
         """
         A recursive method for searching the graph and getting all possible paths in the graph.
         It uses a "dumb" depth-first search without labelling.
@@ -161,6 +263,7 @@ class CombinationsFinder(object):
             max_flights_count (int, optional): Maximal number of flights in the path.
                 This might be useful when searching a graph with huge number of nodes to limit the execution time of the method.
             forbid_backlinks (bool, optional): If true, once visited airport cannot be visited again (except for cycles).
+            constraints (SearchConstraints, optional): A child which breaks them is skipped with its whole branch.
 
         Returns:
             False if the recursion must be stopped in the current branch.
@@ -171,8 +274,8 @@ class CombinationsFinder(object):
             return False
         last_node = current_path[-1]
         for child in self._get_children(last_node):
-            # I cannot fly with the same flight twice. It should not be possible, but just to be safe :).
-            if child in current_path:
+            # I cannot fly with the same flight twice. It is possible only if the graph has a cycle.
+            if not self.graph_is_acyclic and child in current_path:
                 return False
             # We must check for repeated segments.
             if self._is_segment_duplicate_in_path(current_path, child):
@@ -181,8 +284,15 @@ class CombinationsFinder(object):
             if forbid_backlinks and self._is_destination_duplicate_in_path(current_path, self.flight_database[child]['destination']):
                 return False
             else:
-                self.all_paths.append(current_path + [child])
-                self._find_all_paths_recursively(current_path + [child], max_flights_count, forbid_backlinks)
+                # Longer paths would break the constraints too.
+                if constraints is not None and not constraints.is_flight_allowed(current_path[0], child):
+                    continue
+                new_path = current_path + [child]
+                if constraints is None or constraints.is_end_allowed(child):
+                    self.all_paths.append(new_path)
+                # A flight without subsequent flights cannot extend the path.
+                if self.graph_children[child]:
+                    self._find_all_paths_recursively(new_path, max_flights_count, forbid_backlinks, constraints)
 
     @staticmethod
     def _check_two_flights_stopover(arrival_str, departure_str, max_stopover_hours, min_stopover_hours):
@@ -206,10 +316,25 @@ class CombinationsFinder(object):
         """
         arrival_time = datetime.datetime.strptime(arrival_str, '%Y-%m-%dT%H:%M:%S')
         departure_time = datetime.datetime.strptime(departure_str, '%Y-%m-%dT%H:%M:%S')
-        max_next_departure = arrival_time + datetime.timedelta(hours=max_stopover_hours)
-        min_next_departure = arrival_time + datetime.timedelta(hours=min_stopover_hours)
-        #print arrival_time, departure_time, min_next_departure, max_next_departure
-        if departure_time >= min_next_departure and departure_time <= max_next_departure:
+        return CombinationsFinder._check_stopover_times(arrival_time, departure_time,
+                                                        datetime.timedelta(hours=max_stopover_hours),
+                                                        datetime.timedelta(hours=min_stopover_hours))
+
+    @staticmethod
+    def _check_stopover_times(arrival_time, departure_time, max_stopover, min_stopover):
+        """
+        The same check as _check_two_flights_stopover(), but for already parsed times.
+
+        Args:
+            arrival_time (datetime): Arrival time of the first flight.
+            departure_time (datetime): Departure time of the second flight.
+            max_stopover (timedelta): Maximal waiting time between two subsequent flights.
+            min_stopover (timedelta): Minimal waiting time between two subsequent flights.
+
+        Returns:
+            True if the flights may be connected and the waiting time is in the interval, False otherwise.
+        """
+        if arrival_time + min_stopover <= departure_time <= arrival_time + max_stopover:
             return True
         else:
             return False
@@ -286,26 +411,7 @@ class CombinationsFinder(object):
                 ...
             ]
         """
-        output_list = []
-        for path in input_comb_list:
-            # Calculate total trip time.
-            start_time = datetime.datetime.strptime(self.flight_database[path[0]]['departure_time'], '%Y-%m-%dT%H:%M:%S')
-            end_time = datetime.datetime.strptime(self.flight_database[path[-1]]['arrival_time'], '%Y-%m-%dT%H:%M:%S')
-            total_duration = round((end_time - start_time).total_seconds() / 3600, 2)
-            # Prepare data.
-            temp_dict = OrderedDict([
-                ('source', self.flight_database[path[0]]['source']),
-                ('destination', self.flight_database[path[-1]]['destination']),
-                ('total_duration', total_duration),
-                ('flights_count', len(path)),
-                ('start_time', self.flight_database[path[0]]['departure_time']),
-                ('end_time', self.flight_database[path[-1]]['arrival_time']),
-                ('flights_combination', path),
-            ])
-            # Save data.
-            output_list.append(temp_dict)
-        # Convert the list to JSON.
-        return json.dumps(output_list)
+        return ''.join(self.iter_found_combinations_as_json(input_comb_list))
 
     def process_and_format_found_combinations_to_csv(self, input_comb_list, write_header=True):
         """
@@ -322,26 +428,59 @@ class CombinationsFinder(object):
                 HKT,HKT,5.92,2,2016-10-11T05:15:00,2016-10-11T11:10:00,h1 u1
                 ...
         """
-        #print('Total paths: %d') % len(input_comb_list)
-        header = 'source,destination,total_duration,flights_count,start_time,end_time,flights_combination'
-        output_string = header+'\n' if write_header else ''
+        return ''.join(self.iter_found_combinations_as_csv(input_comb_list, write_header))
+
+    def iter_found_combinations_as_json(self, input_comb_list):
+        """
+        Same as process_and_format_found_combinations_to_json(), but the JSON string is generated in parts
+        (one combination at a time), so a large output does not have to be built in memory.
+
+        Args:
+            input_comb_list (iterable): Combinations (paths), i.e. a list or a result sink.
+        """
+        yield '['
+        for n_path, path in enumerate(input_comb_list):
+            yield (', ' if n_path else '') + json.dumps(self._get_combination_info(path))
+        yield ']'
+
+    def iter_found_combinations_as_csv(self, input_comb_list, write_header=True):
+        """
+        Same as process_and_format_found_combinations_to_csv(), but the CSV lines are generated one by one.
+
+        Args:
+            input_comb_list (iterable): Combinations (paths), i.e. a list or a result sink.
+            write_header (bool, optional): If true, the header is the first line.
+        """
+        if write_header:
+            yield 'source,destination,total_duration,flights_count,start_time,end_time,flights_combination\n'
         for path in input_comb_list:
-            # Calculate total trip time.
-            start_time = datetime.datetime.strptime(self.flight_database[path[0]]['departure_time'], '%Y-%m-%dT%H:%M:%S')
-            end_time = datetime.datetime.strptime(self.flight_database[path[-1]]['arrival_time'], '%Y-%m-%dT%H:%M:%S')
-            total_duration = round((end_time - start_time).total_seconds() / 3600, 2)
-            # Prepare data.
-            temp_list = ([
-                self.flight_database[path[0]]['source'],
-                self.flight_database[path[-1]]['destination'],
-                str(total_duration),
-                str(len(path)),
-                self.flight_database[path[0]]['departure_time'],
-                self.flight_database[path[-1]]['arrival_time'],
+            info = self._get_combination_info(path)
+            # Create a comma-separated string from the values.
+            yield ','.join([
+                info['source'],
+                info['destination'],
+                str(info['total_duration']),
+                str(info['flights_count']),
+                info['start_time'],
+                info['end_time'],
                 ' '.join(path),
-            ])
-            # Create a comma-separated string from the list. Add it to the total string.
-            temp_str = ','.join(temp_list)
-            output_string += temp_str + '\n'
+            ]) + '\n'
+
+    def _get_combination_info(self, path):
+        """
+        Prepare information about a flight combination (see process_and_format_found_combinations_to_json()).
+        """
+        # Calculate total trip time.
+        start_time = datetime.datetime.strptime(self.flight_database[path[0]]['departure_time'], '%Y-%m-%dT%H:%M:%S')
+        end_time = datetime.datetime.strptime(self.flight_database[path[-1]]['arrival_time'], '%Y-%m-%dT%H:%M:%S')
+        total_duration = round((end_time - start_time).total_seconds() / 3600, 2)
         # Result
-        return output_string
+        return OrderedDict([
+            ('source', self.flight_database[path[0]]['source']),
+            ('destination', self.flight_database[path[-1]]['destination']),
+            ('total_duration', total_duration),
+            ('flights_count', len(path)),
+            ('start_time', self.flight_database[path[0]]['departure_time']),
+            ('end_time', self.flight_database[path[-1]]['arrival_time']),
+            ('flights_combination', path),
+        ])
@@ -0,0 +1,208 @@
+# -*- coding: UTF-8 -*-
+import bisect
+import datetime
+
+from CombinationsFinder import CombinationsFinder
+
+
+class ConnectionScanner(object):
+    """
+    Second engine for questions about journeys between two airports (Connection Scan Algorithm).
+    Instead of a graph of flights, it uses the flights sorted by departure (and by arrival) time.
+    Every query is then a single linear pass over the sorted flights.
+
+    Usage:
+    1. CombinationsFinder.read_input()
+    2. ConnectionScanner(comb_finder, max_stopover_hours, min_stopover_hours)
+    3. earliest_arrival(), latest_departure() or profile()
+
+    The stopover rules are the same as in CombinationsFinder (see _check_two_flights_stopover()).
+    Unlike in the combinations, a journey may also be a single direct flight and segment/backlink rules are not applied.
+    All times are strings in YYYY-MM-DDTHH:MM:SS format, journeys are lists of flight numbers.
+    """
+
+    def __init__(self, comb_finder, max_stopover_hours, min_stopover_hours=1):
+        """
+        Parse times of all flights and sort the flights.
+
+        Args:
+            comb_finder (CombinationsFinder): Object with read input data (flight_database).
+            max_stopover_hours (int): Maximal waiting time between two subsequent flights (in hours).
+            min_stopover_hours (int, optional): Minimal waiting time between two subsequent flights (in hours).
+        """
+        self.flight_database = comb_finder.flight_database
+        self.max_stopover = datetime.timedelta(hours=max_stopover_hours)
+        self.min_stopover = datetime.timedelta(hours=min_stopover_hours)
+        # Flights as tuples (departure, arrival, source, destination, flight number).
+        self.flights = []
+        for f_number, flight in self.flight_database.items():
+            self.flights.append((self._parse_time(flight['departure_time']), self._parse_time(flight['arrival_time']),
+                                 flight['source'], flight['destination'], f_number))
+        self.flights_by_departure = sorted(self.flights)
+        self.flights_by_arrival = sorted(self.flights, key=lambda f: (f[1], f[0]), reverse=True)
+
+
+    #### PUBLIC METHODS
+
+    def earliest_arrival(self, source, destination, start_time=None):
+        """
+        Find the journey which arrives to the destination as soon as possible.
+
+        Args:
+            source (str): Code of the source airport.
+            destination (str): Code of the destination airport.
+            start_time (str, optional): The first flight must not depart earlier.
+
+        Returns:
+            List of flight numbers or None if the destination cannot be reached.
+        """
+        front = self._scan_forward(source, destination, start_time, stop_at_first=True)
+        return front[0] if front else None
+
+    def profile(self, source, destination, start_time=None):
+        """
+        Find all Pareto-optimal journeys by arrival time and number of flights.
+        (No other journey arrives sooner with the same or lower number of flights.)
+
+        Args:
+            source (str): Code of the source airport.
+            destination (str): Code of the destination airport.
+            start_time (str, optional): The first flight must not depart earlier.
+
+        Returns:
+            List of journeys (lists of flight numbers) sorted by arrival time, the number of flights decreases.
+        """
+        return self._scan_forward(source, destination, start_time, stop_at_first=False)
+
+    def latest_departure(self, source, destination, end_time=None):
+        """
+        Find the journey which departs from the source as late as possible and still reaches the destination.
+
+        Args:
+            source (str): Code of the source airport.
+            destination (str): Code of the destination airport.
+            end_time (str, optional): The last flight must not arrive later.
+
+        Returns:
+            List of flight numbers or None if the destination cannot be reached.
+        """
+        end_time = self._parse_time(end_time) if end_time else None
+        departures = {}  # Reached flights by source airport. 'airport_code' => [(departure, flight_number), ...]
+        successor = {}   # The next flight of the journey. 'flight_number' => 'flight_number' (None for the last flight)
+        best, best_departure = None, None
+        for departure, arrival, f_source, f_destination, f_number in self.flights_by_arrival:
+            # Flights arriving before the best departure cannot depart later.
+            if best is not None and arrival <= best_departure:
+                break
+            if f_destination == destination and (end_time is None or arrival <= end_time):
+                successor[f_number] = None
+            else:
+                next_flight = self._find_next_flight(departures.get(f_destination, []), arrival)
+                if next_flight is None:
+                    continue
+                successor[f_number] = next_flight
+            bisect.insort(departures.setdefault(f_source, []), (departure, f_number))
+            if f_source == source and (best is None or departure > best_departure):
+                best, best_departure = f_number, departure
+        # Result
+        if best is None:
+            return None
+        journey = [best]
+        while successor[journey[-1]] is not None:
+            journey.append(successor[journey[-1]])
+        return journey
+
+
+    #### PRIVATE METHODS
+
+    def _scan_forward(self, source, destination, start_time, stop_at_first):
+        """
+        Scan flights by departure time and compute the minimal number of flights needed to reach every flight.
+
+        Returns:
+            Pareto front of journeys to the destination (see profile()).
+            If stop_at_first is set, the scan stops after the earliest arrival is known (the front has one journey).
+        """
+        start_time = self._parse_time(start_time) if start_time else None
+        arrivals = {}     # Reached flights by destination. 'airport_code' => [(arrival, legs, flight_number), ...]
+        predecessor = {}  # The previous flight of the journey. 'flight_number' => 'flight_number' (None for the first)
+        front = []        # Journeys to the destination. [(arrival, legs, flight_number), ...]
+        earliest_arrival = direct_arrival = None
+        for departure, arrival, f_source, f_destination, f_number in self.flights_by_departure:
+            # Flights departing after the earliest arrival cannot arrive sooner
+            # and after the arrival of a direct flight they cannot improve the Pareto front.
+            if stop_at_first and earliest_arrival is not None and departure >= earliest_arrival:
+                break
+            if not stop_at_first and direct_arrival is not None and departure >= direct_arrival:
+                break
+            if f_source == source and (start_time is None or departure >= start_time):
+                legs = 1
+                predecessor[f_number] = None
+            else:
+                candidates = self._find_previous_flights(arrivals.get(f_source, []), departure)
+                if not candidates:
+                    continue
+                best_candidate = min(candidates, key=lambda c: (c[1], c[0]))
+                legs = best_candidate[1] + 1
+                predecessor[f_number] = best_candidate[2]
+            bisect.insort(arrivals.setdefault(f_destination, []), (arrival, legs, f_number))
+            if f_destination == destination:
+                front.append((arrival, legs, f_number))
+                earliest_arrival = min(arrival, earliest_arrival or arrival)
+                if legs == 1:
+                    direct_arrival = min(arrival, direct_arrival or arrival)
+        # Keep only Pareto-optimal journeys.
+        pareto = []
+        for arrival, legs, f_number in sorted(front):
+            if not pareto or legs < pareto[-1][1]:
+                pareto.append((arrival, legs, f_number))
+        if stop_at_first:
+            pareto = pareto[:1]
+        # Result
+        journeys = []
+        for _, _, f_number in pareto:
+            journey = [f_number]
+            while predecessor[journey[0]] is not None:
+                journey.insert(0, predecessor[journey[0]])
+            journeys.append(journey)
+        return journeys
+
+    def _find_previous_flights(self, sorted_arrivals, departure):
+        """
+        Find reached flights which can be connected with the flight departing at the given time.
+
+        Args:
+            sorted_arrivals (list): Reached flights arriving to the airport. [(arrival, legs, flight_number), ...]
+            departure (datetime): Departure of the next flight.
+        """
+        candidates = []
+        index = bisect.bisect_left(sorted_arrivals, (departure - self.max_stopover,))
+        # Arrivals are sorted, the first one which is too late ends the window.
+        while index < len(sorted_arrivals) and \
+                CombinationsFinder._check_stopover_times(sorted_arrivals[index][0], departure,
+                                                         self.max_stopover, self.min_stopover):
+            candidates.append(sorted_arrivals[index])
+            index += 1
+        return candidates
+
+    def _find_next_flight(self, sorted_departures, arrival):
+        """
+        Find a reached flight which can be connected with the flight arriving at the given time.
+
+        Args:
+            sorted_departures (list): Reached flights departing from the airport. [(departure, flight_number), ...]
+            arrival (datetime): Arrival of the previous flight.
+
+        Returns:
+            Flight number or None.
+        """
+        index = bisect.bisect_left(sorted_departures, (arrival + self.min_stopover,))
+        if index < len(sorted_departures) and \
+                CombinationsFinder._check_stopover_times(arrival, sorted_departures[index][0],
+                                                         self.max_stopover, self.min_stopover):
+            return sorted_departures[index][1]
+        return None
+
+    @staticmethod
+    def _parse_time(time_str):
+        return datetime.datetime.strptime(time_str, '%Y-%m-%dT%H:%M:%S')
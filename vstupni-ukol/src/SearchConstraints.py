@@ -0,0 +1,136 @@
+# -*- coding: UTF-8 -*-
+import datetime
+
+
+class SearchConstraints(object):
+    """
+    Conditions for the flight combinations, checked during the search (see find_flight_combinations()).
+    Conditions of the first flight reduce the flights which start the search. The other ones stop a branch
+    as soon as its path breaks them - subsequent flights arrive later, so they cannot fix it.
+    The result is the same as filtering all combinations by is_path_accepted(), but much less paths are inspected.
+
+    All conditions are optional. Times are strings in YYYY-MM-DDTHH:MM:SS format (as in the input data).
+    """
+
+    def __init__(self, origins=None, destinations=None, max_duration_hours=None, earliest_start=None,
+                 latest_start=None, latest_end=None, excluded_airports=None):
+        """
+        Args:
+            origins (list, optional): Codes of airports where the trip may start.
+            destinations (list, optional): Codes of airports where the trip may end.
+            max_duration_hours (float, optional): Maximal time from the first departure to the last arrival (in hours).
+            earliest_start (str, optional): The first flight must not depart earlier.
+            latest_start (str, optional): The first flight must not depart later.
+            latest_end (str, optional): The last flight must not arrive later.
+            excluded_airports (list, optional): Codes of airports which must not be visited.
+
+        Raises:
+            ValueError: Wrong time format.
+        """
+        self.origins = set(origins) if origins else None
+        self.destinations = set(destinations) if destinations else None
+        self.max_duration = datetime.timedelta(hours=max_duration_hours) if max_duration_hours is not None else None
+        self.earliest_start = earliest_start
+        self.latest_start = latest_start
+        self.latest_end = latest_end
+        self.excluded_airports = set(excluded_airports or [])
+        # Check the time format. The times are then compared as strings (the format keeps their order).
+        for time_str in (earliest_start, latest_start, latest_end):
+            if time_str is not None:
+                self._parse_time(time_str)
+        # Prepared for a flight graph (see prepare()).
+        self.comb_finder = None
+        self.flight_database = {}
+        self.departure_times = {}  # Parsed times (only with max_duration). 'flight_number' => datetime
+        self.arrival_times = {}
+        self.reaching_flights = None  # Flights from which a destination can be reached (only with destinations).
+
+    def prepare(self, comb_finder):
+        """
+        Prepare the constraints for the flight graph of the finder (it is done only once for a finder).
+
+        Args:
+            comb_finder (CombinationsFinder): Object with generated connections (graph).
+        """
+        if self.comb_finder is comb_finder:
+            return
+        self.comb_finder = comb_finder
+        self.flight_database = comb_finder.flight_database
+        if self.max_duration is not None:
+            for f_number, flight in self.flight_database.items():
+                self.departure_times[f_number] = self._parse_time(flight['departure_time'])
+                self.arrival_times[f_number] = self._parse_time(flight['arrival_time'])
+        if self.destinations is not None:
+            self.reaching_flights = self._find_reaching_flights(comb_finder.graph_children)
+
+    def is_start_allowed(self, flight_id):
+        """
+        Check if a trip can start with the flight.
+        """
+        flight = self.flight_database[flight_id]
+        if self.origins is not None and flight['source'] not in self.origins:
+            return False
+        if flight['source'] in self.excluded_airports:
+            return False
+        if self.earliest_start is not None and flight['departure_time'] < self.earliest_start:
+            return False
+        if self.latest_start is not None and flight['departure_time'] > self.latest_start:
+            return False
+        return self.is_flight_allowed(flight_id, flight_id)
+
+    def is_flight_allowed(self, first_flight_id, flight_id):
+        """
+        Check if the flight can continue a trip which started with the first flight.
+        If not, no path with this flight (and subsequent flights) is accepted.
+        """
+        flight = self.flight_database[flight_id]
+        if flight['destination'] in self.excluded_airports:
+            return False
+        if self.latest_end is not None and flight['arrival_time'] > self.latest_end:
+            return False
+        if self.max_duration is not None and \
+                self.arrival_times[flight_id] - self.departure_times[first_flight_id] > self.max_duration:
+            return False
+        if self.reaching_flights is not None and flight_id not in self.reaching_flights:
+            return False
+        return True
+
+    def is_end_allowed(self, flight_id):
+        """
+        Check if a trip can end with the flight.
+        """
+        return self.destinations is None or self.flight_database[flight_id]['destination'] in self.destinations
+
+    def is_path_accepted(self, path):
+        """
+        Check the whole path (list of flight numbers) - i.e. to filter combinations found without constraints.
+        """
+        if not self.is_start_allowed(path[0]) or not self.is_end_allowed(path[-1]):
+            return False
+        return all(self.is_flight_allowed(path[0], flight_id) for flight_id in path[1:])
+
+
+    #### PRIVATE METHODS
+
+    def _find_reaching_flights(self, graph_children):
+        """
+        Find flights from which a destination can be reached (searching the graph backwards from the destinations).
+        """
+        parents = dict((flight_id, []) for flight_id in graph_children)
+        for flight_id, children in graph_children.items():
+            for child in children:
+                parents[child].append(flight_id)
+        reaching = set(f_number for f_number, flight in self.flight_database.items()
+                       if flight['destination'] in self.destinations)
+        # The list is extended while iterating.
+        to_inspect = list(reaching)
+        for flight_id in to_inspect:
+            for parent in parents.get(flight_id, []):
+                if parent not in reaching:
+                    reaching.add(parent)
+                    to_inspect.append(parent)
+        return reaching
+
+    @staticmethod
+    def _parse_time(time_str):
+        return datetime.datetime.strptime(time_str, '%Y-%m-%dT%H:%M:%S')
@@ -0,0 +1,182 @@
+# -*- coding: UTF-8 -*-
+import os
+import sys
+import heapq
+import struct
+import datetime
+import tempfile
+
+
+class SpillingPathSink(object):
+    """
+    Memory-bounded storage for found flight combinations (a result sink for find_flight_combinations()).
+    Paths are buffered as packed fixed-size records: 64-bit sort key + 32-bit flight indexes (big-endian unsigned
+    integers, padded with zeros), so comparison of the records as strings is the same as comparison of the numbers.
+    When the buffer exceeds the memory budget, it is sorted in place and written to a temporary file (a "run").
+    Iterating over the sink merges the runs (k-way merge), so the paths come out sorted by the chosen key.
+    At most MAX_MERGE_RUNS runs are open at once, more runs are first merged in groups to longer runs.
+
+    Usage:
+        sink = SpillingPathSink(comb_finder, max_flights_count, memory_budget_mb=64, sort_by='total_duration')
+        comb_finder.find_flight_combinations(max_flights_count, result_sink=sink)
+        for path in sink: ...
+        sink.close()
+    """
+
+    SORT_KEYS = (None, 'start_time', 'total_duration')
+    KEY_BIAS = 2 ** 63      # Added to the sort key, so negative keys are stored as unsigned integers too.
+    MAX_MERGE_RUNS = 64     # Maximal number of runs merged at once (open files).
+    RECORD_OVERHEAD = 24    # List slot of a record, its over-allocation and a temporary slot of the sort (bytes).
+
+    def __init__(self, comb_finder, max_flights_count, memory_budget_mb=64, sort_by=None, temp_dir=None):
+        """
+        Args:
+            comb_finder (CombinationsFinder): Object with read input data (flight_database).
+            max_flights_count (int): Maximal number of flights in a path (size of a record).
+            memory_budget_mb (float, optional): Approximate memory for buffered paths (in MB).
+                Three quarters are used by the buffer before spilling, a quarter by the read buffers of the runs
+                during merging (memory of the freed buffer records is not always returned to the system).
+            sort_by (str, optional): None (order in which the paths were found), 'start_time' or 'total_duration'.
+            temp_dir (str, optional): Directory for the temporary files (the system default if not set).
+
+        Raises:
+            ValueError: Unsupported sort key.
+        """
+        if sort_by not in self.SORT_KEYS:
+            raise ValueError('Paths can be sorted only by start_time or total_duration.')
+        self.sort_by = sort_by
+        self.temp_dir = temp_dir
+        self.record_struct = struct.Struct('>Q%dI' % max_flights_count)
+        self.max_flights_count = max_flights_count
+        # Real cost of a buffered record is the string object and its place in the list.
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+        record_cost = sys.getsizeof('x' * self.record_struct.size) + self.RECORD_OVERHEAD
+        self.buffer_capacity = max(1, self.memory_budget * 3 // 4 // record_cost)
+        # Flights as integers (indexes from 1, 0 is padding). Times are in minutes from the first departure.
+        self.flight_numbers = [None] + sorted(comb_finder.flight_database)
+        self.flight_indexes = dict((f_number, i) for i, f_number in enumerate(self.flight_numbers) if i)
+        departures = [self._parse_time(comb_finder.flight_database[f]['departure_time']) for f in self.flight_numbers[1:]]
+        arrivals = [self._parse_time(comb_finder.flight_database[f]['arrival_time']) for f in self.flight_numbers[1:]]
+        first_departure = min(departures) if departures else None
+        self.departure_minutes = [0] + [self._to_minutes(t - first_departure) for t in departures]
+        self.arrival_minutes = [0] + [self._to_minutes(t - first_departure) for t in arrivals]
+        # Storage
+        self.buffer = []
+        self.runs = []    # Paths of the spilled runs.
+        self.count = 0
+
+    def append(self, path):
+        """
+        Add a path (list of flight numbers).
+        """
+        indexes = [self.flight_indexes[f_number] for f_number in path]
+        if self.sort_by == 'start_time':
+            key = self.departure_minutes[indexes[0]]
+        elif self.sort_by == 'total_duration':
+            key = self.arrival_minutes[indexes[-1]] - self.departure_minutes[indexes[0]]
+        else:
+            key = self.count
+        indexes.extend([0] * (self.max_flights_count - len(indexes)))
+        self.buffer.append(self.record_struct.pack(key + self.KEY_BIAS, *indexes))
+        self.count += 1
+        if len(self.buffer) >= self.buffer_capacity:
+            self._spill()
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        """
+        Iterate over all paths (lists of flight numbers), sorted by the sort key.
+        """
+        if self.runs:
+            self._spill()
+            while len(self.runs) > self.MAX_MERGE_RUNS:
+                self._merge_runs()
+            records = self._merge_records(self.runs)
+        else:
+            self.buffer.sort()
+            records = self.buffer
+        for record in records:
+            yield [self.flight_numbers[i] for i in self.record_struct.unpack(record)[1:] if i]
+
+    def close(self):
+        """
+        Delete the temporary files.
+        """
+        for run in self.runs:
+            os.remove(run)
+        self.runs = []
+        self.buffer = []
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    #### PRIVATE METHODS
+
+    def _spill(self):
+        """
+        Sort the buffer (in place) and write it to a temporary file.
+        """
+        if not self.buffer:
+            return
+        self.buffer.sort()
+        file_handle, file_path = tempfile.mkstemp(prefix='paths_run_', dir=self.temp_dir)
+        with os.fdopen(file_handle, 'wb') as run_file:
+            for record in self.buffer:
+                run_file.write(record)
+        self.runs.append(file_path)
+        self.buffer = []
+
+    def _merge_runs(self):
+        """
+        One pass of the merge: merge every MAX_MERGE_RUNS runs to a new run and delete them.
+        """
+        merged_runs = []
+        for n_group in range(0, len(self.runs), self.MAX_MERGE_RUNS):
+            group = self.runs[n_group:n_group + self.MAX_MERGE_RUNS]
+            if len(group) == 1:
+                merged_runs.extend(group)
+                continue
+            file_handle, file_path = tempfile.mkstemp(prefix='paths_run_', dir=self.temp_dir)
+            merged_runs.append(file_path)
+            with os.fdopen(file_handle, 'wb') as run_file:
+                for record in self._merge_records(group):
+                    run_file.write(record)
+            for run in group:
+                os.remove(run)
+        self.runs = merged_runs
+
+    def _merge_records(self, runs):
+        """
+        Merge the sorted records of the runs.
+        """
+        # Read buffers of all runs together take a quarter of the memory budget.
+        chunk_records = max(1, self.memory_budget // 4 // self.record_struct.size // len(runs))
+        return heapq.merge(*[self._read_run(run, chunk_records) for run in runs])
+
+    def _read_run(self, file_path, chunk_records):
+        """
+        Read records of a run in chunks (only a small part of every run is in memory during the merge).
+        """
+        size = self.record_struct.size
+        with open(file_path, 'rb') as run_file:
+            while True:
+                chunk = run_file.read(chunk_records * size)
+                if not chunk:
+                    return
+                for offset in xrange(0, len(chunk), size):
+                    yield chunk[offset:offset + size]
+
+    @staticmethod
+    def _parse_time(time_str):
+        return datetime.datetime.strptime(time_str, '%Y-%m-%dT%H:%M:%S')
+
+    @staticmethod
+    def _to_minutes(delta):
+        return delta.days * 1440 + delta.seconds // 60